@@ -0,0 +1,168 @@
+"""
+Application Insights transport module for the Kusto Agent.
+
+This module sends Kusto queries to the Application Insights query API over a
+pooled keep-alive session, POSTing the query as a JSON body and negotiating
+gzip compressed responses.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENDPOINT = "https://api.applicationinsights.io"
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+DEFAULT_POOL_MAXSIZE = 10
+
+
+class AppInsightsQueryError(Exception):
+    """Raised when the Application Insights API rejects or fails a query."""
+
+    def __init__(self, message, status_code=None, code=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.code = code
+
+
+class AppInsightsClient:
+    """
+    Client for the ``/v1/apps/{app_id}/query`` API of one application.
+
+    Args:
+        app_id (str): The Application Insights application id.
+        endpoint (str, optional): Base URL of the query API.
+        connect_timeout (float, optional): Seconds to wait for a connection.
+        read_timeout (float, optional): Seconds to wait between response bytes.
+        pool_maxsize (int, optional): Keep-alive connections kept in the pool.
+    """
+
+    def __init__(
+        self,
+        app_id,
+        endpoint=DEFAULT_ENDPOINT,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+    ):
+        self.app_id = app_id
+        self.url = f"{endpoint.rstrip('/')}/v1/apps/{app_id}/query"
+        self.timeout = (connect_timeout, read_timeout)
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "Content-Type": "application/json",
+        })
+
+    def post(self, query, token, timespan=None, stream=False):
+        """
+        Send a query and return the raw response.
+
+        Args:
+            query (str): The Kusto query text.
+            token (str): A bearer token for api.applicationinsights.io.
+            timespan (str, optional): An ISO 8601 timespan limiting the query.
+            stream (bool, optional): Leave the body unread for incremental use.
+
+        Returns:
+            requests.Response: The successful response.
+
+        Raises:
+            AppInsightsQueryError: If the API returns an error status.
+        """
+        body = {"query": query}
+        if timespan:
+            body["timespan"] = timespan
+        response = self.session.post(
+            self.url,
+            json=body,
+            headers={"Authorization": f"Bearer {token}"},
+            timeout=self.timeout,
+            stream=stream,
+        )
+        if response.status_code >= 400:
+            raise _error_from_response(response)
+        return response
+
+    def query(self, query, token, timespan=None):
+        """
+        Run a query and return the decoded JSON response.
+
+        See :meth:`post` for the arguments.
+
+        Returns:
+            dict: The response body, with the result in ``tables``.
+        """
+        return self.post(query, token, timespan=timespan).json()
+
+    def close(self):
+        self.session.close()
+
+
+def _error_from_response(response):
+    code = None
+    message = response.text
+    try:
+        error = response.json().get("error", {})
+        code = error.get("code")
+        message = error.get("message") or message
+        inner = error.get("innererror") or {}
+        while inner:
+            if inner.get("message"):
+                message = f"{message}: {inner['message']}"
+            inner = inner.get("innererror") or {}
+    except ValueError:
+        pass
+    return AppInsightsQueryError(message, status_code=response.status_code, code=code)
+
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_appinsights_client(appinsight_config):
+    """
+    Get the shared client for an Application Insights application.
+
+    Args:
+        appinsight_config (dict): The ``appinsight`` section of the configuration.
+
+    Returns:
+        AppInsightsClient: A client reused by every caller with the same
+        application id, endpoint and pool size.
+    """
+    endpoint = appinsight_config.get("endpoint") or DEFAULT_ENDPOINT
+    pool_maxsize = int(appinsight_config.get("pool_maxsize") or DEFAULT_POOL_MAXSIZE)
+    key = (appinsight_config["app_id"], endpoint, pool_maxsize)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = AppInsightsClient(
+                appinsight_config["app_id"],
+                endpoint=endpoint,
+                connect_timeout=float(appinsight_config.get("connect_timeout") or DEFAULT_CONNECT_TIMEOUT),
+                read_timeout=float(appinsight_config.get("read_timeout") or DEFAULT_READ_TIMEOUT),
+                pool_maxsize=pool_maxsize,
+            )
+    return client
+
+
+def close_appinsights_clients():
+    """Close every shared Application Insights client."""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
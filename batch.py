@@ -0,0 +1,241 @@
+"""
+Batch runner module for the Kusto Agent.
+
+This module reads natural language requirements from a JSONL file, generates
+and executes their Kusto queries concurrently on one event loop, and writes
+each result to an output JSONL file as soon as it completes.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+_ID_FIELDS = ("id", "request_id")
+_TEXT_FIELDS = ("requirement", "input", "question", "text", "body", "title")
+
+
+def read_requests(input_path):
+    """
+    Read batch requests from a JSONL file.
+
+    Each line is either a JSON object or a JSON string. Objects take their id
+    from ``id`` or ``request_id`` and their requirement from the first of
+    ``requirement``, ``input``, ``question``, ``text``, ``body`` and ``title``
+    that is present. Lines without an id are numbered from 1.
+
+    Args:
+        input_path (str): Path to the JSONL file.
+
+    Returns:
+        list: ``(request_id, requirement)`` tuples in file order.
+    """
+    requests = []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                requests.append((str(line_number), item))
+                continue
+            request_id = next((str(item[k]) for k in _ID_FIELDS if item.get(k) is not None), str(line_number))
+            requirement = next((item[k] for k in _TEXT_FIELDS if item.get(k)), None)
+            if requirement is None:
+                logger.warning("Skipping line %d of %s: no requirement field", line_number, input_path)
+                continue
+            requests.append((request_id, requirement))
+    return requests
+
+
+def new_result(request_id, requirement):
+    """Return an empty result record for one requirement."""
+    return {"id": request_id, "requirement": requirement, "query": None, "error": None,
+            "attempts": [], "timings": {"generate": 0.0, "execute": 0.0}}
+
+
+async def run_request(request_id, requirement, context, result=None):
+    """
+    Generate and execute the query for one requirement, raising on failure.
+
+    Queries failing validation or execution are regenerated with their
+    error, see :mod:`repair`.
+
+    Args:
+        request_id (str): Identifier copied into the result.
+        requirement (str): The natural language requirement.
+        context (dict): The configuration sections and credentials, see :func:`run_batch`.
+        result (dict, optional): The record filled in as stages complete,
+            see :func:`new_result`.
+
+    Returns:
+        dict: The result record, with ``attempts`` listing each generated
+        query and the error it failed with.
+
+    Raises:
+        RepairExhaustedError: If every generated query failed.
+    """
+    from export import output_path_for
+    from main import agenerate_kusto_query, export_kusto_query, forget_generated_query, run_kusto_query
+    from query_guard import prepare_query
+    from repair import arun_with_repair
+    from schema_registry import get_schema
+    from token_provider import get_token_provider
+
+    result = result if result is not None else new_result(request_id, requirement)
+    repair_config = context.get("repair_config") or {}
+    token = context.get("token") or get_token_provider(context["auth_config"])
+
+    async def generate(feedback):
+        generating = time.perf_counter()
+        query = await agenerate_kusto_query(
+            requirement,
+            context["azure_config"],
+            context["schema_path"],
+            context["retrieval_config"],
+            context["generation_cache_config"],
+            feedback,
+        )
+        result["query"] = query
+        result["timings"]["generate"] = round(result["timings"]["generate"] + time.perf_counter() - generating, 4)
+        return query
+
+    schema = get_schema(context["schema_path"])
+
+    def validate(query):
+        return prepare_query(query, schema, context.get("validation_config"), context.get("guard_config")).query
+
+    async def execute(query):
+        result["query"] = query
+        executed = time.perf_counter()
+        try:
+            if context.get("output"):
+                # Rows are streamed to a file per request instead of into the results JSONL
+                stats = await asyncio.to_thread(
+                    export_kusto_query,
+                    query,
+                    token,
+                    context["app_id"],
+                    output_path_for(context["output"], request_id),
+                    context["appinsight_config"],
+                    context["result_cache_config"],
+                )
+                result["output"] = stats.path
+                result["row_count"] = stats.rows
+                result["bytes"] = stats.bytes
+            else:
+                response = await asyncio.to_thread(
+                    run_kusto_query,
+                    query,
+                    token,
+                    context["app_id"],
+                    context["appinsight_config"],
+                    context["result_cache_config"],
+                )
+                table = response["tables"][0]
+                result["columns"] = [column["name"] for column in table["columns"]]
+                result["rows"] = table["rows"]
+        finally:
+            result["timings"]["execute"] = round(result["timings"]["execute"] + time.perf_counter() - executed, 4)
+
+    def on_error(attempt):
+        forget_generated_query(requirement, context["azure_config"], context["schema_path"],
+                               context["generation_cache_config"])
+
+    outcome = await arun_with_repair(generate, execute, validate, repair_config.get("max_attempts"),
+                                     repair_config.get("deadline"), on_error)
+    result["attempts"] = [{"query": a.query, "error": a.error} for a in outcome.attempts]
+    return result
+
+
+async def process_request(request_id, requirement, context):
+    """
+    Generate and execute the query for one requirement.
+
+    Args:
+        request_id (str): Identifier copied into the result.
+        requirement (str): The natural language requirement.
+        context (dict): The configuration sections and credentials, see :func:`run_batch`.
+
+    Returns:
+        dict: The result record, with ``error`` set when a stage failed and
+        ``attempts`` listing each generated query and the error it failed with.
+    """
+    from metrics import profile
+    from repair import RepairExhaustedError
+
+    result = new_result(request_id, requirement)
+    started = time.perf_counter()
+    with profile() as request_profile:
+        try:
+            await run_request(request_id, requirement, context, result)
+        except RepairExhaustedError as e:
+            result["attempts"] = [{"query": a.query, "error": a.error} for a in e.attempts]
+            result["error"] = f"{type(e).__name__}: {e}"
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+    result["timings"]["total"] = round(time.perf_counter() - started, 4)
+    if context.get("profile"):
+        result["profile"] = request_profile.to_dict()
+    return result
+
+
+async def run_batch(input_path, output_path, context, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Process every request of a JSONL file with bounded concurrency.
+
+    Results are appended to ``output_path`` in completion order.
+
+    Args:
+        input_path (str): JSONL file of requirements, see :func:`read_requests`.
+        output_path (str): JSONL file the results are written to.
+        context (dict): ``azure_config``, ``appinsight_config``, ``app_id``,
+            ``schema_path``, ``retrieval_config``, ``generation_cache_config``,
+            ``result_cache_config``, either ``token`` (a bearer token or
+            TokenProvider) or ``auth_config`` to build a provider from, and
+            optionally ``output``, a file path template rows are exported to
+            per request (see :func:`export.output_path_for`), and
+            ``validation_config`` to reject invalid queries before execution
+            and ``guard_config`` to bound their time range and rows
+            and ``repair_config`` to regenerate queries that fail, and
+            ``profile`` to add each request's stage timings to its result.
+        concurrency (int, optional): Requests processed at the same time.
+
+    Returns:
+        dict: Counts of ``succeeded`` and ``failed`` requests and the
+        ``elapsed`` wall time in seconds.
+    """
+    from llm_client import aclose_clients
+
+    requests = read_requests(input_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="kusto-batch"))
+
+    async def bounded(request_id, requirement):
+        async with semaphore:
+            return await process_request(request_id, requirement, context)
+
+    summary = {"succeeded": 0, "failed": 0}
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(bounded(request_id, requirement)) for request_id, requirement in requests]
+    try:
+        with open(output_path, "w", encoding="utf-8") as f:
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                f.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+                f.flush()
+                summary["failed" if result["error"] else "succeeded"] += 1
+                logger.info("Finished request %s (%d/%d)", result["id"],
+                            summary["succeeded"] + summary["failed"], len(requests))
+    finally:
+        for task in tasks:
+            task.cancel()
+        await aclose_clients()
+    summary["elapsed"] = round(time.perf_counter() - started, 4)
+    return summary
@@ -0,0 +1,312 @@
+"""
+Benchmark module for the Kusto Agent.
+
+This module runs the generate-then-execute pipeline against the local stub
+services of :mod:`stub_servers` and reports throughput and p50/p95/p99
+latency of each entry point, so regressions in pooling, caching and decoding
+show up without network access or credentials. The ``startup`` path times
+``python main.py --help`` in fresh interpreters, so an eager import of a heavy
+dependency shows up too.
+
+Example::
+
+    python benchmark.py --requests 200 --llm-latency 0.2 --query-latency 0.1 --rows 5000
+    python benchmark.py --paths startup --max-startup 0.5
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+import click
+
+from config import get_config
+from metrics import registry
+from stub_servers import StubOptions, StubServer
+
+logger = logging.getLogger(__name__)
+
+PATHS = ("startup", "repl", "batch", "server")
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def percentile(values, q):
+    """Return the nearest-rank ``q`` percentile (0-100) of ``values``."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+@dataclass
+class BenchmarkReport:
+    """Latencies and errors of the requests sent through one entry point."""
+
+    path: str
+    elapsed: float
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    stages: dict = field(default_factory=dict)
+
+    @property
+    def requests(self):
+        return len(self.latencies) + self.errors
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "requests": self.requests,
+            "errors": self.errors,
+            "elapsed": round(self.elapsed, 4),
+            "throughput": round(self.throughput, 2),
+            "p50": round(percentile(self.latencies, 50), 4),
+            "p95": round(percentile(self.latencies, 95), 4),
+            "p99": round(percentile(self.latencies, 99), 4),
+            "stages": self.stages,
+        }
+
+    def __str__(self):
+        return (f"{self.path:<6} {self.requests} requests, {self.errors} errors in {self.elapsed:.2f}s: "
+                f"{self.throughput:.1f} req/s, p50 {percentile(self.latencies, 50) * 1000:.1f}ms, "
+                f"p95 {percentile(self.latencies, 95) * 1000:.1f}ms, p99 {percentile(self.latencies, 99) * 1000:.1f}ms")
+
+
+def build_context(openai_url, appinsights_url, use_cache=False, config=None):
+    """
+    Build a batch context pointing at stub services.
+
+    Args:
+        openai_url (str): Base URL of the chat completions stub.
+        appinsights_url (str): Base URL of the query stub.
+        use_cache (bool, optional): Keep the generation and result caches enabled.
+        config (dict, optional): The configuration to start from.
+
+    Returns:
+        dict: A context for :func:`batch.run_batch`.
+    """
+    config = config or get_config()
+    disabled = {"enabled": False}
+    return {
+        "azure_config": {**config.get("azure_openai", {}), "endpoint": openai_url, "api_key": "benchmark",
+                         "api_version": "2024-10-21", "deployment_name": "benchmark"},
+        "appinsight_config": {**config.get("appinsight", {}), "endpoint": appinsights_url, "app_id": "benchmark"},
+        "app_id": "benchmark",
+        "token": "benchmark",
+        "auth_config": {},
+        "schema_path": config.get("schema", {}).get("path"),
+        "retrieval_config": config.get("retrieval", {}),
+        "generation_cache_config": config.get("generation_cache", {}) if use_cache else disabled,
+        "result_cache_config": config.get("result_cache", {}) if use_cache else None,
+        "validation_config": config.get("validation", {}),
+        "guard_config": config.get("query_guard", {}),
+        "repair_config": config.get("repair", {}),
+    }
+
+
+def bench_startup(runs):
+    """Run ``python main.py --help`` ``runs`` times, each in a fresh interpreter."""
+    report = BenchmarkReport("startup", 0.0)
+    started = time.perf_counter()
+    for _ in range(runs):
+        run_started = time.perf_counter()
+        completed = subprocess.run([sys.executable, MAIN_SCRIPT, "--help"], stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE)
+        if completed.returncode == 0:
+            report.latencies.append(time.perf_counter() - run_started)
+        else:
+            logger.debug("Startup failed: %s", completed.stderr.decode("utf-8", "replace"))
+            report.errors += 1
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def _discard(*args, **kwargs):
+    pass
+
+
+def bench_repl(requirements, context):
+    """Send the requirements one after another through the interactive loop's request, without printing."""
+    from main import answer_requirement
+
+    report = BenchmarkReport("repl", 0.0)
+    started = time.perf_counter()
+    for i, requirement in enumerate(requirements, start=1):
+        request_started = time.perf_counter()
+        try:
+            answer_requirement(requirement, context, i, echo=_discard)
+            report.latencies.append(time.perf_counter() - request_started)
+        except Exception as e:
+            logger.debug("REPL request failed: %s", e)
+            report.errors += 1
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def bench_batch(requirements, context, concurrency):
+    """Process the requirements with :func:`batch.run_batch`."""
+    from batch import run_batch
+
+    report = BenchmarkReport("batch", 0.0)
+    with tempfile.TemporaryDirectory(prefix="kusto-benchmark-") as directory:
+        input_path = os.path.join(directory, "requests.jsonl")
+        output_path = os.path.join(directory, "results.jsonl")
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i, requirement in enumerate(requirements, start=1):
+                f.write(json.dumps({"id": i, "requirement": requirement}) + "\n")
+        summary = asyncio.run(run_batch(input_path, output_path, context, concurrency))
+        with open(output_path, "r", encoding="utf-8") as f:
+            for line in f:
+                result = json.loads(line)
+                if result["error"]:
+                    report.errors += 1
+                else:
+                    report.latencies.append(result["timings"]["total"])
+    report.elapsed = summary["elapsed"]
+    return report
+
+
+def bench_server(requirements, context, concurrency):
+    """Send the requirements to ``POST /query`` of the HTTP service, ``concurrency`` at a time."""
+    import httpx
+    import uvicorn
+
+    from server import create_app
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    server = uvicorn.Server(uvicorn.Config(create_app(context, {"concurrency": concurrency}), log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, name="benchmark-server", daemon=True)
+    thread.start()
+    while not server.started and thread.is_alive():
+        time.sleep(0.01)
+
+    report = BenchmarkReport("server", 0.0)
+
+    async def send_all():
+        semaphore = asyncio.Semaphore(concurrency)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=None) as client:
+            async def send(requirement):
+                async with semaphore:
+                    request_started = time.perf_counter()
+                    response = await client.post("/query", json={"requirement": requirement})
+                    if response.status_code == 200:
+                        report.latencies.append(time.perf_counter() - request_started)
+                    else:
+                        report.errors += 1
+
+            await asyncio.gather(*(send(requirement) for requirement in requirements))
+
+    started = time.perf_counter()
+    try:
+        asyncio.run(send_all())
+    finally:
+        report.elapsed = time.perf_counter() - started
+        server.should_exit = True
+        thread.join()
+    return report
+
+
+def run_benchmark(paths, requests, distinct, openai_options, appinsights_options, concurrency=8, use_cache=False,
+                  startup_runs=5):
+    """
+    Benchmark the entry points against fresh stub services.
+
+    Args:
+        paths (list): Entry points to benchmark, see :data:`PATHS`.
+        requests (int): Requests sent through each entry point.
+        distinct (int): Distinct requirements among them.
+        openai_options (StubOptions): Behaviour of the chat completions stub.
+        appinsights_options (StubOptions): Behaviour of the query stub.
+        concurrency (int, optional): Requests in flight for concurrent entry points.
+        use_cache (bool, optional): Keep the generation and result caches enabled.
+        startup_runs (int, optional): CLI starts timed by the ``startup`` path.
+
+    Returns:
+        list: One BenchmarkReport per entry point.
+    """
+    from appinsights import close_appinsights_clients
+    from llm_client import close_clients
+
+    requirements = [f"Count the events of each name, variant {i % distinct}" for i in range(requests)]
+    reports = []
+    with StubServer("openai", openai_options) as openai_stub, \
+            StubServer("appinsights", appinsights_options) as appinsights_stub:
+        context = build_context(openai_stub.url, appinsights_stub.url, use_cache)
+        for path in paths:
+            registry.reset()
+            if path == "startup":
+                report = bench_startup(startup_runs)
+            elif path == "repl":
+                report = bench_repl(requirements, context)
+            elif path == "batch":
+                report = bench_batch(requirements, context, concurrency)
+            elif path == "server":
+                report = bench_server(requirements, context, concurrency)
+            else:
+                raise ValueError(f"Unknown benchmark path {path!r}, use one of {', '.join(PATHS)}")
+            report.stages = registry.snapshot()["stages"]
+            reports.append(report)
+            logger.info("%s", report)
+        close_clients()
+        close_appinsights_clients()
+    return reports
+
+
+@click.command()
+@click.option('--paths', 'paths', default=",".join(PATHS), help='Comma separated entry points to benchmark')
+@click.option('--requests', 'requests', default=100, help='Requests sent through each entry point')
+@click.option('--distinct', 'distinct', default=None, type=int, help='Distinct requirements, defaults to --requests')
+@click.option('--concurrency', 'concurrency', default=8, help='Requests in flight for batch and server paths')
+@click.option('--cache/--no-cache', 'use_cache', default=False, help='Keep the generation and result caches enabled')
+@click.option('--llm-latency', 'llm_latency', default=0.2, help='Seconds before the first completion chunk')
+@click.option('--token-latency', 'token_latency', default=0.005, help='Seconds between completion chunks')
+@click.option('--llm-error-rate', 'llm_error_rate', default=0.0, help='Fraction of completions failing with 500')
+@click.option('--query-latency', 'query_latency', default=0.1, help='Seconds before the query response')
+@click.option('--query-error-rate', 'query_error_rate', default=0.0, help='Fraction of queries failing with 400')
+@click.option('--jitter', 'jitter', default=0.0, help='Random extra latency in seconds for both stubs')
+@click.option('--rows', 'rows', default=100, help='Rows per query response')
+@click.option('--row-bytes', 'row_bytes', default=200, help='Approximate bytes per row')
+@click.option('--startup-runs', 'startup_runs', default=5, help='CLI starts timed by the startup path')
+@click.option('--max-startup', 'max_startup', default=None, type=float,
+              help='Fail when the median CLI start takes longer than this many seconds')
+@click.option('--output', 'output', default=None, help='Write the reports to a JSON file')
+def main(paths, requests, distinct, concurrency, use_cache, llm_latency, token_latency, llm_error_rate,
+         query_latency, query_error_rate, jitter, rows, row_bytes, startup_runs, max_startup, output):
+    openai_options = StubOptions(latency=llm_latency, jitter=jitter, error_rate=llm_error_rate,
+                                 token_latency=token_latency)
+    appinsights_options = StubOptions(latency=query_latency, jitter=jitter, error_rate=query_error_rate,
+                                      rows=rows, row_bytes=row_bytes)
+    reports = run_benchmark([path.strip() for path in paths.split(",") if path.strip()], requests,
+                            distinct or requests, openai_options, appinsights_options, concurrency, use_cache,
+                            startup_runs)
+    for report in reports:
+        print(report)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump([report.to_dict() for report in reports], f, indent=2)
+    for report in reports:
+        if report.path == "startup" and max_startup is not None:
+            if report.errors or percentile(report.latencies, 50) > max_startup:
+                raise click.ClickException(f"CLI startup took {percentile(report.latencies, 50):.3f}s "
+                                           f"with {report.errors} failures, the limit is {max_startup:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+Caching module for the Kusto Agent.
+
+This module provides an in-memory LRU tier and an optional SQLite tier, both
+with a time-to-live, and the caches used in front of query generation and
+query execution so that repeated requirements skip the chat-completions round
+trip and repeated queries skip Application Insights.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache evicting the least recently used entries.
+
+    Args:
+        max_entries (int, optional): Entries kept before evicting.
+        ttl (float, optional): Seconds an entry stays valid, None for forever.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteCache:
+    """
+    Persistent cache storing JSON values in a SQLite database.
+
+    Args:
+        path (str): Path to the database file.
+        namespace (str): Table name, so several caches can share a file.
+        ttl (float, optional): Seconds an entry stays valid, None for forever.
+    """
+
+    def __init__(self, path, namespace, ttl=DEFAULT_TTL):
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", namespace):
+            raise ValueError(f"Invalid cache namespace: {namespace}")
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {namespace} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.namespace} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at <= time.time():
+            self.delete(key)
+            return None
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.namespace} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+
+    def delete(self, key):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.namespace} WHERE key = ?", (key,))
+
+    def purge_expired(self):
+        """Delete every expired entry and return how many were removed."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"DELETE FROM {self.namespace} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                (time.time(),),
+            )
+        return cursor.rowcount
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {self.namespace}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TieredCache:
+    """
+    Memory cache backed by an optional persistent cache, with hit counters.
+
+    Values found only in the persistent tier are promoted into memory.
+    """
+
+    def __init__(self, memory, persistent=None):
+        self.memory = memory
+        self.persistent = persistent
+        self.stats = {"hits": 0, "memory_hits": 0, "persistent_hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, *names):
+        with self._stats_lock:
+            for name in names:
+                self.stats[name] += 1
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("hits", "memory_hits")
+            return value
+        if self.persistent is not None:
+            try:
+                value = self.persistent.get(key)
+            except sqlite3.Error as e:
+                logger.warning("Persistent cache read failed: %s", e)
+                value = None
+            if value is not None:
+                self.memory.set(key, value)
+                self._count("hits", "persistent_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl=ttl)
+        if self.persistent is not None:
+            try:
+                self.persistent.set(key, value, ttl=ttl)
+            except sqlite3.Error as e:
+                logger.warning("Persistent cache write failed: %s", e)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        if self.persistent is not None:
+            self.persistent.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+
+def _build_tiered_cache(cache_config, namespace):
+    ttl = cache_config.get("ttl", DEFAULT_TTL)
+    memory = LRUCache(int(cache_config.get("max_entries") or DEFAULT_MAX_ENTRIES), ttl=ttl)
+    persistent = None
+    if cache_config.get("path"):
+        persistent = SqliteCache(cache_config["path"], namespace, ttl=ttl)
+    return TieredCache(memory, persistent)
+
+
+_QUOTED_PATTERN = re.compile(r"(\"[^\"]*\"|'[^']*')")
+# Sentence punctuation ending a word, not operators, dashes or decimal points
+_PUNCTUATION_PATTERN = re.compile(r"[?!.,]+(?=\s|$)")
+
+
+def normalize_requirement(user_input):
+    """
+    Normalize a natural language requirement for cache lookups.
+
+    Case, whitespace and sentence punctuation ending a word are ignored
+    outside quotes; operators such as ``>`` and ``!=``, dashes and decimal
+    points are kept, and quoted literals such as event names are kept verbatim.
+    """
+    parts = []
+    for i, part in enumerate(_QUOTED_PATTERN.split(user_input)):
+        if i % 2:
+            parts.append(part)
+        else:
+            parts.append(_PUNCTUATION_PATTERN.sub("", part).lower())
+    return " ".join(" ".join(parts).split())
+
+
+def generation_cache_key(user_input, schema_version, deployment_name):
+    """Return the cache key of a requirement for a schema version and deployment."""
+    payload = json.dumps([normalize_requirement(user_input), schema_version, deployment_name])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_LINE_COMMENT_PATTERN = re.compile(r"//[^\n]*")
+_KQL_STRING_PATTERN = re.compile(r"(\"(?:[^\"\\]|\\.)*\"|'(?:[^'\\]|\\.)*')")
+
+
+def canonicalize_query(query):
+    """
+    Canonicalize KQL text for cache lookups.
+
+    Comments, redundant whitespace and trailing semicolons are dropped outside
+    string literals; everything else, including case, is significant.
+    """
+    parts = []
+    for i, part in enumerate(_KQL_STRING_PATTERN.split(query)):
+        if i % 2:
+            parts.append(part)
+        else:
+            parts.append(" ".join(_LINE_COMMENT_PATTERN.sub(" ", part).split()))
+    return " ".join(part for part in parts if part).strip().rstrip(";").strip()
+
+
+def result_cache_key(query, app_id, bucket_seconds, now=None):
+    """
+    Return the cache key of a query for an application and time bucket.
+
+    Queries with relative times such as ``ago(1h)`` return different rows as
+    time passes, so keys change every ``bucket_seconds``.
+    """
+    bucket = int((time.time() if now is None else now) // bucket_seconds) if bucket_seconds else 0
+    payload = json.dumps([canonicalize_query(query), app_id, bucket])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_generation_cache(cache_config):
+    """
+    Get the shared query generation cache.
+
+    Args:
+        cache_config (dict): The ``generation_cache`` section of the
+            configuration. ``path`` enables the persistent SQLite tier.
+
+    Returns:
+        TieredCache: The cache, or None when it is disabled.
+    """
+    if not cache_config or not cache_config.get("enabled"):
+        return None
+    key = ("generation", cache_config.get("path"), cache_config.get("max_entries"), cache_config.get("ttl"))
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = _build_tiered_cache(cache_config, "generation")
+    return cache
+
+
+def get_result_cache(cache_config):
+    """
+    Get the shared query result cache.
+
+    Entries live at most one time bucket, so ``bucket_seconds`` is used as the
+    TTL.
+
+    Args:
+        cache_config (dict): The ``result_cache`` section of the configuration.
+            ``path`` enables the persistent SQLite tier.
+
+    Returns:
+        TieredCache: The cache, or None when it is disabled.
+    """
+    if not cache_config or not cache_config.get("enabled"):
+        return None
+    key = ("result", cache_config.get("path"), cache_config.get("max_entries"), cache_config.get("bucket_seconds"))
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = _build_tiered_cache(
+                {**cache_config, "ttl": cache_config.get("bucket_seconds") or None}, "result"
+            )
+    return cache
@@ -6,7 +6,6 @@ This module contains configuration settings for the A2A Agent application.
 
 import os
 import logging
-import yaml
 
 logger = logging.getLogger(__name__)
 
@@ -17,16 +16,105 @@ DEFAULT_CONFIG = {
         "endpoint": None,  # Should be set via environment variable
         "api_version": None,  # Should be set via environment variable
         "deployment_name": None,  # Should be set via environment variable
+        "max_connections": 20,
+        "max_keepalive_connections": 10,
+        "keepalive_expiry": 60.0,
+        "connect_timeout": 10.0,
+        "read_timeout": 120.0,
+        "max_retries": 2,
     },
     "appinsight": {
         "app_id": None,  # Should be set via environment variable
+        "endpoint": "https://api.applicationinsights.io",
+        "connect_timeout": 10.0,
+        "read_timeout": 120.0,
+        "pool_maxsize": 10,  # Keep-alive connections, the server raises it to its concurrency
     },
     "openai":{
         "openai_api_key": None
+    },
+    "schema": {
+        "path": None,  # Defaults to the kusto_schema.txt next to main.py
+    },
+    "retrieval": {
+        "enabled": False,  # Per-requirement schema subsets keep the prompt prefix cache from covering the schema
+        "embedder": "hashing",  # "hashing" (offline) or "azure_openai"
+        "embedding_deployment": None,  # Required for the azure_openai embedder
+        "index_dir": None,  # Defaults to .kusto_index next to main.py
+        "top_k_columns": 12,
+        "top_k_keys": 20,
+        "max_schema_tokens": 3000,  # Lowest priority keys, then columns, are dropped beyond this
+        "tokenizer": "o200k_base",  # tiktoken encoding used to count prompt tokens
+    },
+    "generation_cache": {
+        "enabled": True,
+        "max_entries": 1024,
+        "ttl": 86400,  # Seconds
+        "path": None,  # SQLite file for the persistent tier, memory only when unset
+    },
+    "result_cache": {
+        "enabled": True,
+        "max_entries": 256,
+        "max_rows": 50000,  # Larger results are not cached
+        "bucket_seconds": 60,  # Identical queries within a bucket share results
+        "path": None,  # SQLite file for the persistent tier, memory only when unset
+    },
+    "validation": {
+        "enabled": True,  # Check generated queries against the schema before sending them
+    },
+    "query_guard": {
+        "enabled": True,  # Bound queries missing a time filter or row limit before sending them
+        "time_column": "timestamp",
+        "time_range": "24h",  # ago() timespan of the added time filter, None never adds one
+        "row_limit": 10000,  # Rows of the added take, None never adds one
+    },
+    "repair": {
+        "max_attempts": 3,  # Generations per requirement, 1 disables repairing failed queries
+        "deadline": 60,  # Seconds after which no further repair is attempted
+    },
+    "server": {
+        "concurrency": 32,  # Threads running App Insights calls for concurrent HTTP requests
+        "stream_chunk_rows": 500,  # Rows per event of /query/stream
+        "stream_buffer": 8,  # Events buffered per streaming client before generation and reads pause
+    },
+    "metrics": {
+        "path": None,  # JSONL file a metrics snapshot is appended to on exit
+        "host": None,  # Interface of the Prometheus endpoint, all interfaces when unset
+        "port": None,  # Serve Prometheus text on http://<host>:<port>/metrics when set
+    },
+    "auth": {
+        "method": "interactive",  # interactive, default, client_secret, managed_identity, azure_cli or device_code
+        "scope": "https://api.applicationinsights.io/.default",
+        "tenant_id": None,
+        "client_id": None,
+        "client_secret": None,  # Should be set via environment variable
+        "refresh_margin": 300,  # Seconds before expiry at which the token is refreshed
+        "background_refresh": True,
+        "cache_path": None,  # File the access token is persisted to
+    },
+    "batch": {
+        "concurrency": 8,  # Requests in flight per process
+        "workers": 1,  # More than one runs a resumable process pool
+        "queue_path": None,  # Defaults to <output>.queue.sqlite
     }
 }
 
 
+def _deep_update(base, updates):
+    """
+    Merge ``updates`` into ``base`` in place, section by section.
+
+    Args:
+        base (dict): The configuration to update.
+        updates (dict): The values overriding it, nested like ``base``.
+    """
+    for key, value in (updates or {}).items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _deep_update(base[key], value)
+        else:
+            base[key] = value
+
+
 def get_config(config_path=None):
     """
     Get the configuration for the application.
@@ -40,6 +128,7 @@ def get_config(config_path=None):
     import json
     from copy import deepcopy
     from dotenv import load_dotenv
+    import yaml
     
     # Ensure environment variables are loaded, with .env.local taking precedence
     load_dotenv()
@@ -51,6 +140,8 @@ def get_config(config_path=None):
         with open(config_path, 'r') as f:
             custom_config = yaml.safe_load(f)
             _deep_update(config, custom_config)
+    elif config_path:
+        logger.warning("Configuration file %s not found, using the defaults", config_path)
       # Override with environment variables
         
     # Override Azure OpenAI settings from environment variables
@@ -67,6 +158,37 @@ def get_config(config_path=None):
     if os.environ.get('AZURE_APPINSIGHT_ID'):
         config['appinsight']['app_id'] = os.environ.get('AZURE_APPINSIGHT_ID')
     
+    # Override schema settings from environment variables
+    if os.environ.get('KUSTO_SCHEMA_PATH'):
+        config['schema']['path'] = os.environ.get('KUSTO_SCHEMA_PATH')
+
+    # Override retrieval settings from environment variables
+    if os.environ.get('AZURE_OPENAI_EMBEDDING_DEPLOYMENT'):
+        config['retrieval']['embedder'] = 'azure_openai'
+        config['retrieval']['embedding_deployment'] = os.environ.get('AZURE_OPENAI_EMBEDDING_DEPLOYMENT')
+
+    # Override auth settings from environment variables
+    if os.environ.get('KUSTO_AUTH_METHOD'):
+        config['auth']['method'] = os.environ.get('KUSTO_AUTH_METHOD')
+    if os.environ.get('AZURE_TENANT_ID'):
+        config['auth']['tenant_id'] = os.environ.get('AZURE_TENANT_ID')
+    if os.environ.get('AZURE_CLIENT_ID'):
+        config['auth']['client_id'] = os.environ.get('AZURE_CLIENT_ID')
+    if os.environ.get('AZURE_CLIENT_SECRET'):
+        config['auth']['client_secret'] = os.environ.get('AZURE_CLIENT_SECRET')
+    if os.environ.get('KUSTO_TOKEN_CACHE_PATH'):
+        config['auth']['cache_path'] = os.environ.get('KUSTO_TOKEN_CACHE_PATH')
+
+    # Override cache settings from environment variables
+    if os.environ.get('KUSTO_GENERATION_CACHE_PATH'):
+        config['generation_cache']['path'] = os.environ.get('KUSTO_GENERATION_CACHE_PATH')
+
+    # Override metrics settings from environment variables
+    if os.environ.get('KUSTO_METRICS_PATH'):
+        config['metrics']['path'] = os.environ.get('KUSTO_METRICS_PATH')
+    if os.environ.get('KUSTO_METRICS_PORT'):
+        config['metrics']['port'] = int(os.environ.get('KUSTO_METRICS_PORT'))
+
     # Override OpenAI settings from environment variables
     if os.environ.get('OPEN_API_KEY'):
         config['openai']['openai_api_key'] = os.environ.get('OPEN_API_KEY')
@@ -0,0 +1,182 @@
+"""
+Dynamic column module for the Kusto Agent.
+
+Cells of ``dynamic`` columns such as ``customDimensions`` and
+``customMeasurements`` arrive as JSON encoded strings. This module keeps them
+raw and parses a cell only when one of its keys is read, and extracts single
+keys across whole columns without building every bag.
+"""
+
+import json
+import logging
+from collections.abc import Mapping, Sequence
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # pragma: no cover - optional dependency
+    _loads = json.loads
+
+_MISSING = object()
+
+
+def parse_dynamic(raw):
+    """Parse a raw dynamic cell, returning non-string cells unchanged."""
+    if isinstance(raw, (str, bytes, bytearray)):
+        if not raw:
+            return None
+        return _loads(raw)
+    return raw
+
+
+class LazyDynamic(Mapping):
+    """
+    A dynamic cell parsed on first key access.
+
+    ``raw`` always holds the cell as received.
+    """
+
+    __slots__ = ("raw", "_parsed")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._parsed = _MISSING
+
+    @property
+    def value(self):
+        if self._parsed is _MISSING:
+            self._parsed = parse_dynamic(self.raw)
+        return self._parsed
+
+    def _bag(self):
+        value = self.value
+        return value if isinstance(value, dict) else {}
+
+    def __getitem__(self, key):
+        return self._bag()[key]
+
+    def __iter__(self):
+        return iter(self._bag())
+
+    def __len__(self):
+        return len(self._bag())
+
+    def __repr__(self):
+        return f"LazyDynamic({self.raw!r})"
+
+
+class LazyRow(Sequence):
+    """
+    A result row readable by position or column name.
+
+    Cells of dynamic columns are returned as LazyDynamic, so
+    ``row["customDimensions"]["JobID"]`` only parses that one bag.
+    """
+
+    __slots__ = ("_values", "_index", "_dynamic")
+
+    def __init__(self, values, index, dynamic):
+        self._values = values
+        self._index = index
+        self._dynamic = dynamic
+
+    def _cell(self, position):
+        value = self._values[position]
+        if position in self._dynamic and value is not None and not isinstance(value, LazyDynamic):
+            value = self._values[position] = LazyDynamic(value)
+        return value
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._cell(self._index[key])
+        if isinstance(key, slice):
+            return [self._cell(position) for position in range(len(self._values))[key]]
+        return self._cell(key)
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, column_name, default=None):
+        position = self._index.get(column_name)
+        return default if position is None else self._cell(position)
+
+    def raw(self):
+        """Return the row values as received, with dynamic cells unparsed."""
+        return [value.raw if isinstance(value, LazyDynamic) else value for value in self._values]
+
+    def __repr__(self):
+        return f"LazyRow({self.raw()!r})"
+
+
+def lazy_rows(columns, rows):
+    """
+    Wrap result rows so that dynamic cells are only parsed when read.
+
+    Args:
+        columns (list): The ``{"name", "type"}`` column descriptions.
+        rows: An iterable of row lists, e.g. a StreamedTable's ``rows``.
+
+    Yields:
+        LazyRow: Each row.
+    """
+    index = {column["name"]: position for position, column in enumerate(columns)}
+    dynamic = frozenset(position for position, column in enumerate(columns) if column["type"] == "dynamic")
+    for row in rows:
+        yield LazyRow(row, index, dynamic)
+
+
+def extract_key(values, key, default=None):
+    """
+    Extract one key from every cell of a dynamic column.
+
+    Cells whose raw text does not mention the key are skipped without being
+    parsed.
+
+    Args:
+        values: The raw cells of a dynamic column.
+        key (str): The key to extract, e.g. ``JobID``.
+        default (optional): Value for cells without the key.
+
+    Returns:
+        list: The extracted values, one per cell.
+    """
+    return extract_keys(values, [key], default)[key]
+
+
+def extract_keys(values, keys, default=None):
+    """
+    Extract several keys from every cell of a dynamic column.
+
+    Each cell that mentions any of the keys is parsed once.
+
+    Args:
+        values: The raw cells of a dynamic column.
+        keys (list): The keys to extract.
+        default (optional): Value for cells without a key.
+
+    Returns:
+        dict: The extracted values by key, one per cell.
+    """
+    keys = list(keys)
+    needles = [(f'"{key}"', f'"{key}"'.encode("utf-8")) for key in keys]
+    extracted = {key: [] for key in keys}
+    for raw in values:
+        if isinstance(raw, LazyDynamic):
+            raw = raw.raw
+        bag = None
+        if isinstance(raw, str):
+            if any(text in raw for text, _ in needles):
+                bag = _loads(raw)
+        elif isinstance(raw, (bytes, bytearray)):
+            if any(data in raw for _, data in needles):
+                bag = _loads(raw)
+        else:
+            bag = raw
+        if not isinstance(bag, dict):
+            bag = {}
+        for key in keys:
+            extracted[key].append(bag.get(key, default))
+    return extracted
@@ -0,0 +1,172 @@
+"""
+Result export module for the Kusto Agent.
+
+This module streams result rows into CSV, NDJSON or Parquet files in
+bounded-size chunks and reports how many rows and bytes were written and how
+fast.
+"""
+
+import csv
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 10000
+FORMATS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet",
+}
+
+
+@dataclass
+class ExportStats:
+    """Counts and throughput of one export."""
+
+    path: str
+    format: str
+    rows: int
+    bytes: int
+    seconds: float
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else float(self.rows)
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.seconds if self.seconds else float(self.bytes)
+
+    def __str__(self):
+        return (f"Wrote {self.rows} rows ({self.bytes / 1e6:.2f} MB) to {self.path} in {self.seconds:.2f}s "
+                f"({self.rows_per_second:,.0f} rows/s, {self.bytes_per_second / 1e6:.2f} MB/s)")
+
+
+def detect_format(path):
+    """Return the export format implied by the extension of ``path``."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported output format {extension!r}, use one of {', '.join(FORMATS)}")
+    return FORMATS[extension]
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _write_csv(f, columns, chunks):
+    writer = csv.writer(f)
+    writer.writerow([column["name"] for column in columns])
+    for chunk in chunks:
+        writer.writerows(chunk)
+
+
+def _is_json_container(value):
+    # Dynamic objects and arrays arrive as JSON text, dynamic scalars such as a projected key as plain strings
+    return value[:1] == "{" and value[-1:] == "}" or value[:1] == "[" and value[-1:] == "]"
+
+
+def _write_ndjson(f, columns, chunks):
+    # Dynamic objects and arrays already hold JSON text and are embedded without a parse round trip
+    prefixes = [json.dumps(column["name"]) + ":" for column in columns]
+    dynamic = [column["type"] == "dynamic" for column in columns]
+    for chunk in chunks:
+        lines = []
+        for row in chunk:
+            fields = []
+            for prefix, is_dynamic, value in zip(prefixes, dynamic, row):
+                if is_dynamic and isinstance(value, str) and _is_json_container(value):
+                    fields.append(prefix + value)
+                else:
+                    fields.append(prefix + json.dumps(value, ensure_ascii=False))
+            lines.append("{" + ",".join(fields) + "}\n")
+        f.write("".join(lines))
+
+
+def _write_parquet(path, columns, chunks):
+    import pyarrow.parquet as pq
+
+    from result_decoder import decode_table
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = decode_table({"columns": columns, "rows": chunk}, "arrow").to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            table = decode_table({"columns": columns, "rows": []}, "arrow").to_arrow()
+            writer = pq.ParquetWriter(path, table.schema)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def export_rows(columns, rows, path, output_format=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Stream rows into a file.
+
+    Rows are consumed ``chunk_size`` at a time, so memory stays bounded when
+    ``rows`` is a generator such as a StreamedTable's rows.
+
+    Args:
+        columns (list): The ``{"name", "type"}`` column descriptions.
+        rows: An iterable of row lists.
+        path (str): The output file.
+        output_format (str, optional): ``csv``, ``ndjson`` or ``parquet``;
+            defaults to the format implied by the extension of ``path``.
+        chunk_size (int, optional): Rows buffered per write.
+
+    Returns:
+        ExportStats: What was written.
+    """
+    output_format = output_format or detect_format(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    started = time.perf_counter()
+    count = 0
+
+    def counted():
+        nonlocal count
+        for chunk in _chunks(rows, chunk_size):
+            count += len(chunk)
+            yield chunk
+
+    if output_format == "parquet":
+        _write_parquet(path, columns, counted())
+    elif output_format in ("csv", "ndjson"):
+        write = _write_csv if output_format == "csv" else _write_ndjson
+        with open(path, "w", encoding="utf-8", newline="", buffering=1024 * 1024) as f:
+            write(f, columns, counted())
+    else:
+        raise ValueError(f"Unsupported output format: {output_format}")
+
+    stats = ExportStats(path, output_format, count, os.path.getsize(path), time.perf_counter() - started)
+    logger.info("%s", stats)
+    return stats
+
+
+def output_path_for(template, request_id):
+    """
+    Return the output file of one request.
+
+    ``{id}`` in ``template`` is replaced by ``request_id``; without it the id
+    is inserted before the extension.
+    """
+    if "{id}" in template:
+        return template.replace("{id}", str(request_id))
+    base, extension = os.path.splitext(template)
+    return f"{base}.{request_id}{extension}"
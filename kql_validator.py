@@ -0,0 +1,297 @@
+"""
+KQL validation module for the Kusto Agent.
+
+This module checks generated Kusto queries against the parsed schema without
+any network call: it tokenizes the query, resolves the source table, column
+references and ``customDimensions.X`` / ``customDimensions["X"]`` keys
+case-sensitively, and reports what does not exist.
+
+The check is deliberately conservative. Names a query defines itself (with
+``=``, ``as``, ``let`` or ``parse ... with``), the columns ``summarize`` and
+``count`` name automatically and the ``<column>_<key>`` names of projected
+dynamic keys are accepted, and nothing after ``evaluate`` is
+checked since plugins such as ``bag_unpack`` add columns of their own, so a
+valid query is never rejected for using them.
+"""
+
+import difflib
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<space>\s+)
+    | (?P<comment>//[^\n]*)
+    | (?P<string>[@hH]?"(?:[^"\\\n]|\\.)*"|[@hH]?'(?:[^'\\\n]|\\.)*')
+    | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?[A-Za-z]*)
+    | (?P<ident>[A-Za-z_$][\w$]*)
+    | (?P<op>==|!=|=~|!~|<=|>=|=>|<>|\.\.|[-+*/%<>=|,;:().\[\]{}!~@])
+    | (?P<other>.)
+    """,
+    re.VERBOSE,
+)
+
+# Operators, keywords, type names and literals that are never column references
+KEYWORDS = frozenset("""
+    where filter project extend summarize by take limit top sample order sort asc desc nulls first last
+    count distinct join union lookup kind on inner outer leftouter rightouter fullouter leftanti
+    rightanti leftsemi rightsemi innerunique anti semi withsource isfuzzy as let with render
+    and or not in has has_cs has_any has_all hasprefix hassuffix contains contains_cs startswith
+    startswith_cs endswith endswith_cs matches regex between like notlike
+    away rename reorder keep mv expand apply make series from to step default parse extract
+    evaluate invoke print range datatable getschema serialize partition scan fork facet
+    consume find search materialize toscalar externaldata hint shuffle strategy broadcast
+    bool boolean int long real double decimal string datetime date timespan time dynamic guid
+    true false null typeof
+    timechart barchart columnchart piechart areachart linechart scatterchart stackedareachart
+    table card anomalychart ladderchart pivotchart treemap
+""".split())
+
+# Columns created implicitly by summarize aggregations, extend and print
+_AUTO_COLUMN_PATTERN = re.compile(
+    r"^(?:count|countif|dcount|dcountif|sum|sumif|avg|avgif|min|max|minif|maxif|any|anyif|"
+    r"arg_max|arg_min|take_any|percentile|percentiles|percentilew|stdev|stdevif|variance|"
+    r"varianceif|make_list|make_set|make_bag|list|set|hll)_\w*$|^Column\d+$|^print_\d+$"
+)
+
+# Leading operators of statements that do not read a table
+_NON_TABLE_SOURCES = frozenset({"union", "datatable", "range", "print", "search", "find",
+                                "externaldata", "materialize", "evaluate"})
+
+
+@dataclass(frozen=True)
+class Token:
+    kind: str
+    text: str
+    position: int
+
+
+@dataclass(frozen=True)
+class ValidationIssue:
+    """One problem found in a query."""
+
+    message: str
+    position: int
+    suggestion: Optional[str] = None
+
+    def __str__(self):
+        if self.suggestion:
+            return f"{self.message} (did you mean {self.suggestion!r}?)"
+        return self.message
+
+
+@dataclass
+class ValidationResult:
+    """The outcome of validating a query."""
+
+    query: str
+    issues: List[ValidationIssue] = field(default_factory=list)
+
+    @property
+    def valid(self):
+        return not self.issues
+
+    def __str__(self):
+        return "; ".join(str(issue) for issue in self.issues) or "valid"
+
+
+class KqlValidationError(ValueError):
+    """Raised when a generated query references tables, columns or keys that do not exist."""
+
+    def __init__(self, result):
+        super().__init__(str(result))
+        self.result = result
+
+
+_FENCE_PATTERN = re.compile(r"```[A-Za-z]*\s*\n?(.*?)```", re.DOTALL)
+
+
+def clean_query(text):
+    """Strip Markdown code fences and surrounding blank space from a model answer."""
+    match = _FENCE_PATTERN.search(text)
+    if match:
+        text = match.group(1)
+    return text.strip()
+
+
+def tokenize(query):
+    """Split a query into tokens, dropping whitespace and comments."""
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        if kind in ("space", "comment"):
+            continue
+        tokens.append(Token(kind, match.group(), match.start()))
+    return tokens
+
+
+def _unquote(text):
+    text = text.lstrip("@hH")
+    return text[1:-1]
+
+
+def _suggest(name, candidates):
+    lowered = {candidate.lower(): candidate for candidate in candidates}
+    if name.lower() in lowered:
+        return lowered[name.lower()]
+    matches = difflib.get_close_matches(name, list(candidates), n=1, cutoff=0.8)
+    return matches[0] if matches else None
+
+
+def _defined_names(tokens):
+    defined = set()
+    parsing = None
+    for i, token in enumerate(tokens):
+        # The names after "parse ... with" up to the next operator are the extracted columns
+        if token.text in ("|", ";"):
+            parsing = None
+        elif token.text == "parse":
+            parsing = "pattern"
+        elif token.text == "with" and parsing == "pattern":
+            parsing = "captures"
+        if token.kind != "ident":
+            continue
+        following = tokens[i + 1].text if i + 1 < len(tokens) else None
+        previous = tokens[i - 1].text if i > 0 else None
+        if following in ("=", ":") or previous == "as":
+            defined.add(token.text)
+        elif parsing == "captures" and token.text != "with" and token.text not in KEYWORDS:
+            defined.add(token.text)
+        elif token.text == "count" and previous == "|":
+            defined.add("Count")
+    return defined
+
+
+def _evaluated_positions(tokens):
+    # Plugins run by evaluate produce columns the schema does not know, for the rest of the statement
+    positions = set()
+    evaluated = False
+    for i, token in enumerate(tokens):
+        if token.text == ";":
+            evaluated = False
+        elif token.text == "evaluate" and i > 0 and tokens[i - 1].text == "|":
+            evaluated = True
+        elif evaluated:
+            positions.add(token.position)
+    return positions
+
+
+def _statements(tokens):
+    statement = []
+    for token in tokens:
+        if token.text == ";":
+            if statement:
+                yield statement
+            statement = []
+        else:
+            statement.append(token)
+    if statement:
+        yield statement
+
+
+def validate_query(query, schema):
+    """
+    Validate a query against a schema.
+
+    Args:
+        query (str): The KQL text, optionally wrapped in a Markdown code fence.
+        schema (Schema): The parsed schema, see :mod:`schema_registry`.
+
+    Returns:
+        ValidationResult: The issues found, empty when the query is valid.
+    """
+    query = clean_query(query)
+    result = ValidationResult(query)
+    tokens = tokenize(query)
+    if not tokens:
+        result.issues.append(ValidationIssue("The query is empty", 0))
+        return result
+
+    defined = _defined_names(tokens)
+    evaluated = _evaluated_positions(tokens)
+    referenced_tables = []
+    sources = set()
+    for statement in _statements(tokens):
+        first = statement[0]
+        sources.add(first.position)
+        if first.kind != "ident" or first.text == "let" or first.text in _NON_TABLE_SOURCES:
+            continue
+        if first.text in defined:
+            continue
+        if not schema.has_table(first.text):
+            result.issues.append(ValidationIssue(
+                f"Unknown table '{first.text}'", first.position, _suggest(first.text, schema.tables)
+            ))
+        else:
+            referenced_tables.append(schema.table(first.text))
+
+    tables = referenced_tables or list(schema.tables.values())
+    columns = {}
+    # Projecting or grouping by column.Key names the result column column_Key
+    accessor_names = set()
+    for table in tables:
+        for column in table.columns:
+            columns.setdefault(column.name, (table, column))
+            if column.is_dynamic:
+                accessor_names.update(f"{column.name}_{key}" for key in table.keys_for(column.name))
+    table_names = set(schema.tables)
+
+    for i, token in enumerate(tokens):
+        if token.kind != "ident":
+            continue
+        name = token.text
+        previous = tokens[i - 1].text if i > 0 else None
+        following = tokens[i + 1].text if i + 1 < len(tokens) else None
+
+        if token.position in sources or token.position in evaluated or previous in (".", "..") or following == "(" or name.startswith("$"):
+            continue
+        if name in KEYWORDS or name in defined or name in accessor_names or name in table_names \
+                or _AUTO_COLUMN_PATTERN.match(name):
+            continue
+        if previous == "-" and i > 1 and tokens[i - 2].text in ("project", "mv", "make"):
+            continue
+
+        if name not in columns:
+            result.issues.append(ValidationIssue(
+                f"Unknown column '{name}'", token.position, _suggest(name, columns)
+            ))
+            continue
+
+        table, column = columns[name]
+        known_keys = table.keys_for(name)
+        if not column.is_dynamic or not known_keys:
+            continue
+        key_token = None
+        if following == "." and i + 2 < len(tokens) and tokens[i + 2].kind == "ident":
+            key_token = tokens[i + 2]
+            key = key_token.text
+        elif (following == "[" and i + 3 < len(tokens) and tokens[i + 2].kind == "string"
+              and tokens[i + 3].text == "]"):
+            key_token = tokens[i + 2]
+            key = _unquote(key_token.text)
+        if key_token is not None and not table.has_key(name, key):
+            result.issues.append(ValidationIssue(
+                f"Unknown {name} key '{key}'", key_token.position, _suggest(key, known_keys)
+            ))
+
+    return result
+
+
+def check_query(query, schema):
+    """
+    Validate a query and raise if it is invalid.
+
+    Returns:
+        str: The query without Markdown code fences.
+
+    Raises:
+        KqlValidationError: If the query references unknown tables, columns or keys.
+    """
+    result = validate_query(query, schema)
+    if not result.valid:
+        raise KqlValidationError(result)
+    return result.query
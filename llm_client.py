@@ -0,0 +1,211 @@
+"""
+Azure OpenAI client module for the Kusto Agent.
+
+This module keeps long-lived, connection-pooled AzureOpenAI clients so that
+repeated query generations reuse keep-alive connections and TLS sessions
+instead of paying for a new handshake on every call. The ``openai`` and
+``httpx`` packages are only imported when the first client is created.
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+
+from metrics import record_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+DEFAULT_MAX_RETRIES = 2
+
+_clients = {}
+_async_clients = {}
+_lock = threading.Lock()
+
+
+def _client_key(azure_config):
+    # Configs differing only by key get their own client, the key itself is not kept in the registry
+    api_key = hashlib.sha256((azure_config.get("api_key") or "").encode("utf-8")).hexdigest()[:16]
+    return (azure_config["endpoint"], azure_config["api_version"], azure_config["deployment_name"], api_key)
+
+
+def _limits(azure_config):
+    import httpx
+
+    return httpx.Limits(
+        max_connections=int(azure_config.get("max_connections") or DEFAULT_MAX_CONNECTIONS),
+        max_keepalive_connections=int(
+            azure_config.get("max_keepalive_connections") or DEFAULT_MAX_KEEPALIVE_CONNECTIONS
+        ),
+        keepalive_expiry=float(azure_config.get("keepalive_expiry") or DEFAULT_KEEPALIVE_EXPIRY),
+    )
+
+
+def _timeout(azure_config):
+    import httpx
+
+    return httpx.Timeout(
+        float(azure_config.get("read_timeout") or DEFAULT_READ_TIMEOUT),
+        connect=float(azure_config.get("connect_timeout") or DEFAULT_CONNECT_TIMEOUT),
+    )
+
+
+def _max_retries(azure_config):
+    max_retries = azure_config.get("max_retries")
+    return DEFAULT_MAX_RETRIES if max_retries is None else int(max_retries)
+
+
+def get_client(azure_config):
+    """
+    Get the shared synchronous client for an Azure OpenAI deployment.
+
+    Args:
+        azure_config (dict): The ``azure_openai`` section of the configuration.
+
+    Returns:
+        AzureOpenAI: A client reused by every caller with the same endpoint,
+        API version, deployment and API key.
+    """
+    key = _client_key(azure_config)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    import httpx
+    from openai import AzureOpenAI
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            logger.info("Creating Azure OpenAI client for %s (%s)", key[0], key[2])
+            client = _clients[key] = AzureOpenAI(
+                api_key=azure_config["api_key"],
+                api_version=azure_config["api_version"],
+                azure_endpoint=azure_config["endpoint"],
+                max_retries=_max_retries(azure_config),
+                timeout=_timeout(azure_config),
+                http_client=httpx.Client(limits=_limits(azure_config), timeout=_timeout(azure_config)),
+            )
+    return client
+
+
+def get_async_client(azure_config):
+    """
+    Get the shared asynchronous client for an Azure OpenAI deployment.
+
+    Async connection pools are bound to the event loop that created them, so
+    this must be called from within a running loop and clients are shared per
+    loop.
+
+    Args:
+        azure_config (dict): The ``azure_openai`` section of the configuration.
+
+    Returns:
+        AsyncAzureOpenAI: A client reused by every caller on the current loop
+        with the same endpoint, API version, deployment and API key.
+    """
+    key = _client_key(azure_config) + (id(asyncio.get_running_loop()),)
+    client = _async_clients.get(key)
+    if client is not None:
+        return client
+    import httpx
+    from openai import AsyncAzureOpenAI
+
+    with _lock:
+        client = _async_clients.get(key)
+        if client is None:
+            logger.info("Creating async Azure OpenAI client for %s (%s)", key[0], key[2])
+            client = _async_clients[key] = AsyncAzureOpenAI(
+                api_key=azure_config["api_key"],
+                api_version=azure_config["api_version"],
+                azure_endpoint=azure_config["endpoint"],
+                max_retries=_max_retries(azure_config),
+                timeout=_timeout(azure_config),
+                http_client=httpx.AsyncClient(
+                    limits=_limits(azure_config), timeout=_timeout(azure_config)
+                ),
+            )
+    return client
+
+
+def close_clients():
+    """
+    Close every shared synchronous client.
+
+    Asynchronous clients have to be closed on their own loop, with
+    :func:`aclose_clients`.
+    """
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_clients():
+    """Close the shared asynchronous clients created on the current loop."""
+    loop_id = id(asyncio.get_running_loop())
+    with _lock:
+        keys = [key for key in _async_clients if key[-1] == loop_id]
+        clients = [_async_clients.pop(key) for key in keys]
+    for client in clients:
+        await client.close()
+
+
+class UsageStats:
+    """
+    Running totals of the token usage reported by chat completions.
+
+    ``cached_tokens`` counts prompt tokens served from Azure OpenAI's prompt
+    prefix cache, so ``cached_ratio`` shows how well the prompt prefix is
+    reused across calls.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, usage):
+        """
+        Add the ``usage`` of one completion to the totals.
+
+        Args:
+            usage: The ``usage`` of a completion response or final stream chunk.
+
+        Returns:
+            dict: ``prompt_tokens``, ``cached_tokens`` and ``completion_tokens`` of this call.
+        """
+        details = getattr(usage, "prompt_tokens_details", None)
+        call = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+            "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+        }
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += call["prompt_tokens"]
+            self.cached_tokens += call["cached_tokens"]
+            self.completion_tokens += call["completion_tokens"]
+        record_tokens(call)
+        logger.info("Completion used %(prompt_tokens)d prompt tokens (%(cached_tokens)d cached), "
+                    "%(completion_tokens)d completion tokens", call)
+        return call
+
+    @property
+    def cached_ratio(self):
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def __str__(self):
+        return (f"{self.calls} completions, {self.prompt_tokens} prompt tokens "
+                f"({self.cached_tokens} cached, {self.cached_ratio:.0%}), "
+                f"{self.completion_tokens} completion tokens")
+
+
+usage_stats = UsageStats()
@@ -1,96 +1,540 @@
-from azure.identity import InteractiveBrowserCredential
-import requests
+import asyncio
+import time
+from appinsights import AppInsightsQueryError, get_appinsights_client, close_appinsights_clients
 from config import get_config
-from openai import AzureOpenAI
+from llm_client import get_client, get_async_client, close_clients, usage_stats
 import click
-from langchain.document_loaders import TextLoader
+from schema_registry import get_schema
+from schema_retrieval import get_retriever
+from schema_encoder import fit_schema
+from cache import canonicalize_query, get_generation_cache, generation_cache_key, get_result_cache, result_cache_key
+from token_provider import get_token_provider, resolve_token
+from response_stream import StreamedTable, stream_response_tables
+from export import export_rows, output_path_for
+from query_guard import prepare_query
+from metrics import observe, profile, registry, span, start_metrics_server
+from repair import RepairExhaustedError, feedback_messages, run_with_repair
+from singleflight import AsyncSingleFlight, SingleFlight
 
 
-config = get_config()
+#Identical requirements or queries in flight at the same time share one call
+_generation_flights = SingleFlight("generate")
+_async_generation_flights = AsyncSingleFlight("generate")
+_query_flights = SingleFlight("execute")
 
 @click.command()
 @click.option('--host', 'host', default='localhost')
 @click.option('--port', 'port', default=5001)
+@click.option('--serve', 'serve', is_flag=True, default=False, help='Serve generation and execution over HTTP on --host/--port')
 @click.option('--config-path', 'config_path', default=None, help='Path to custom configuration file')
-def main(host: str, port: int, config_path: str = None):
-    #Login to your microsoft account
-    credential = InteractiveBrowserCredential()
-    token = credential.get_token("https://api.applicationinsights.io/.default").token
+@click.option('--no-result-cache', 'no_result_cache', is_flag=True, default=False, help='Always send queries to Application Insights')
+@click.option('--no-query-guard', 'no_query_guard', is_flag=True, default=False, help='Send queries without adding a missing time filter or row limit')
+@click.option('--stream/--no-stream', 'stream', default=True, help='Print the generated query as it streams in')
+@click.option('--batch', 'batch_input', default=None, help='JSONL file of requirements to process without prompting')
+@click.option('--batch-output', 'batch_output', default=None, help='JSONL file for batch results, defaults to <batch>.results.jsonl')
+@click.option('--concurrency', 'concurrency', default=None, type=int, help='Batch requests processed at the same time')
+@click.option('--workers', 'workers', default=None, type=int, help='Worker processes for batch mode, resumable across runs')
+@click.option('--output', 'output', default=None, help='Write result rows to a .csv, .ndjson or .parquet file; {id} is replaced per query')
+@click.option('--profile', 'show_profile', is_flag=True, default=False, help='Print the time spent in each stage of every request')
+def main(host: str, port: int, serve: bool = False, config_path: str = None, no_result_cache: bool = False,
+         no_query_guard: bool = False, stream: bool = True,
+         batch_input: str = None, batch_output: str = None, concurrency: int = None, workers: int = None,
+         output: str = None, show_profile: bool = False):
+    #Resolved after parsing so --config-path applies, and --help returns without reading it
+    config = get_config(config_path)
+    #Login to your microsoft account, the token is then refreshed ahead of its expiry
+    auth_config = config.get('auth', {})
+    token = get_token_provider(auth_config)
+    token.get_token()
 
-    app_id = config.get('appinsight',{})["app_id"]
+    appinsight_config = config.get('appinsight',{})
+    app_id = appinsight_config["app_id"]
+    schema_path = config.get('schema', {}).get('path')
+    #Parse the kusto schema once up front, later calls only re-check its mtime
+    with span("schema_load"):
+        get_schema(schema_path)
     #Check for Azure OpenAI configuration
     azure_config = config.get('azure_openai', {})
+    retrieval_config = config.get('retrieval', {})
+    generation_cache_config = config.get('generation_cache', {})
+    result_cache_config = config.get('result_cache', {})
+    validation_config = config.get('validation', {})
+    guard_config = None if no_query_guard else config.get('query_guard', {})
+    repair_config = config.get('repair', {})
+    metrics_config = config.get('metrics', {})
+    #Stage latency histograms and token counts, scraped from /metrics or appended to a JSONL file
+    if metrics_config.get('port'):
+        start_metrics_server(int(metrics_config['port']), metrics_config.get('host') or '0.0.0.0')
+
+    context = {
+        "azure_config": azure_config,
+        "appinsight_config": appinsight_config,
+        "app_id": app_id,
+        "token": token,
+        "auth_config": auth_config,
+        "schema_path": schema_path,
+        "retrieval_config": retrieval_config,
+        "generation_cache_config": generation_cache_config,
+        "result_cache_config": None if no_result_cache else result_cache_config,
+        "output": output,
+        "validation_config": validation_config,
+        "guard_config": guard_config,
+        "repair_config": repair_config,
+        "profile": show_profile,
+    }
+
+    if serve:
+        #One process shares its clients, caches and token across every caller
+        from server import serve as serve_app
+        server_config = config.get('server', {})
+        if concurrency:
+            server_config = {**server_config, "concurrency": concurrency}
+        serve_app({**context, "output": None}, host, port, server_config)
+        return
+
+    if batch_input:
+        from batch import run_batch
+        batch_output = batch_output or f"{batch_input}.results.jsonl"
+        concurrency = concurrency or config.get('batch', {}).get('concurrency')
+        workers = workers or config.get('batch', {}).get('workers')
+        if workers and workers > 1:
+            from worker_pool import run_worker_pool
+            summary = run_worker_pool(batch_input, batch_output, context, workers, concurrency,
+                                      config.get('batch', {}).get('queue_path'))
+        else:
+            summary = asyncio.run(run_batch(batch_input, batch_output, context, concurrency))
+        print(f"Batch finished: {summary['succeeded']} succeeded, {summary['failed']} failed "
+              f"in {summary['elapsed']:.1f}s, results in {batch_output}")
+        if usage_stats.calls:
+            print(f"Token usage: {usage_stats}")
+        if metrics_config.get('path'):
+            registry.write_jsonl(metrics_config['path'])
+        close_appinsights_clients()
+        return
     
+    query_count = 0
     while True:
         user_input = input("Please input the requirement for the query:")
         if user_input.strip().lower() == "exit":
             print("Exiting...")
+            generation_cache = get_generation_cache(generation_cache_config)
+            if generation_cache is not None:
+                print(f"Generation cache stats: {generation_cache.stats}")
+            print(f"Token usage: {usage_stats}")
+            if metrics_config.get('path'):
+                registry.write_jsonl(metrics_config['path'])
+            close_clients()
+            close_appinsights_clients()
             break
         
         print("Generating kusto query......")
-        
-        kusto_query = generate_kusto_query(user_input,azure_config)
-        print(f"The generated kusto query is:\n {kusto_query}")
+        query_count += 1
 
-        execute_kusto_query(kusto_query,token,app_id)        
+        with profile() as request_profile:
+            try:
+                answer_requirement(user_input,context,query_count,stream)
+            except RepairExhaustedError as e:
+                print(f"Giving up: {e}")
+            except Exception as e:
+                print(f"Get exception:{e}")
+        if show_profile:
+            print(f"Profile: {request_profile}")
 
-def generate_kusto_query(user_input,azure_config):
-    client = AzureOpenAI(
-        api_key= azure_config["api_key"],
-        api_version= azure_config["api_version"],
-        azure_endpoint= azure_config["endpoint"]
-    )
+def answer_requirement(user_input,context,query_id,stream=True,echo=print):
+    #One request of the interactive loop, echo prints the query, the attempts and the rows
+    azure_config = context["azure_config"]
+    schema_path = context["schema_path"]
+    retrieval_config = context["retrieval_config"]
+    generation_cache_config = context["generation_cache_config"]
+    validation_config = context.get("validation_config")
+    guard_config = context.get("guard_config")
+    result_cache_config = context["result_cache_config"]
+    output = context.get("output")
+    repair_config = context.get("repair_config") or {}
 
-    # Load the kusto schema
-    loader = TextLoader("kusto_schema.txt")
-    documents = loader.load()
+    def generate(feedback):
+        if feedback:
+            echo("Regenerating the kusto query from the error......")
+        if stream:
+            echo("The generated kusto query is:\n ", end="", flush=True)
+            generation = stream_kusto_query(user_input,azure_config,schema_path,retrieval_config,generation_cache_config,feedback)
+            for delta in generation:
+                echo(delta, end="", flush=True)
+            echo(f"\n(first token after {generation.time_to_first_token or 0:.2f}s, total {generation.total_time:.2f}s, "
+                 f"{generation.usage.get('cached_tokens', 0)}/{generation.usage.get('prompt_tokens', 0)} prompt tokens cached)")
+            return generation.query
+        kusto_query = generate_kusto_query(user_input,azure_config,schema_path,retrieval_config,generation_cache_config,feedback=feedback)
+        echo(f"The generated kusto query is:\n {kusto_query}")
+        return kusto_query
 
-    # Split it into chunks
-    # text_splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    # docs = text_splitter.split_documents(documents)
+    #Reject queries referencing unknown tables, columns or keys, then bound unbounded scans before sending them
+    def validate(kusto_query):
+        guarded = prepare_query(kusto_query, get_schema(schema_path), validation_config, guard_config)
+        if guarded.changed:
+            echo(f"Added {', '.join(guarded.added)}:\n {guarded.query}")
+        return guarded.query
 
-    # # To do Transfer docs into embedding 
-    # embeddings = AzureOpenAIEmbeddings(
-    #     deployment=azure_config["deployment_name"],
-    #     openai_api_key=azure_config["api_key"],
-    #     openai_api_version=azure_config["api_version"]
-    # )
+    def execute(kusto_query):
+        if output:
+            echo(export_kusto_query(kusto_query,context["token"],context["app_id"],output_path_for(output, query_id),
+                                    context["appinsight_config"],result_cache_config))
+            return
+        table = stream_kusto_table(kusto_query,context["token"],context["app_id"],context["appinsight_config"],result_cache_config)
+        echo("The query result is:\n")
+        with span("output"):
+            for row in table.rows:
+                echo(row)
 
-    # db = FAISS.from_documents(docs, embeddings)
-    # db.save_local("kusto_vector_index")
+    def on_error(attempt):
+        echo(f"The query failed: {attempt.error}")
+        forget_generated_query(user_input,azure_config,schema_path,generation_cache_config)
 
-    # relevant_docs = db.similarity_search(query, k=3)
-    # schema = "\n".join([doc.page_content for doc in relevant_docs])
-    
-    prompt =f'''
-            You are an expert in Azure Application Insights, you can translate the user requirement into Kusto query.The message should be 
-            a query that can be execute immediately and no other useless word is needed.
-            Here is the Kusto schema:
-            {documents}
-            The columns appear in the query must satisfy the schema,Distinguish between upper and lower case of English
-            '''
-    response = client.chat.completions.create(
+    #Failing queries are fed back to the model with their error until one runs
+    outcome = run_with_repair(generate, execute, validate, repair_config.get('max_attempts'),
+                              repair_config.get('deadline'), on_error)
+    if len(outcome.attempts) > 1:
+        echo(f"(succeeded after {len(outcome.attempts)} attempts)")
+    return outcome
+
+#Fixed instructions first and the schema last, so the system prompt is byte-stable and
+#Azure OpenAI can serve it from its prompt prefix cache
+SYSTEM_PROMPT = (
+    "You are an expert in Azure Application Insights, you can translate the user requirement into Kusto query. "
+    "The message should be a query that can be execute immediately and no other useless word is needed. "
+    "The columns appear in the query must satisfy the schema, Distinguish between upper and lower case of English.\n"
+    "Here is the Kusto schema:\n"
+)
+
+_system_prompts = {}
+
+def build_system_prompt(schema,retrieval_config=None):
+    # The full schema is rendered once per schema version and budget
+    retrieval_config = retrieval_config or {}
+    key = (schema.version, retrieval_config.get('max_schema_tokens'), retrieval_config.get('tokenizer'))
+    prompt = _system_prompts.get(key)
+    if prompt is None:
+        schema_text = fit_schema(schema, retrieval_config.get('max_schema_tokens'), retrieval_config.get('tokenizer'))
+        prompt = _system_prompts[key] = SYSTEM_PROMPT + schema_text
+    return prompt
+
+def build_messages(user_input,azure_config,schema,retrieval_config=None,feedback=None):
+    retrieval_config = retrieval_config or {}
+    if retrieval_config.get('enabled'):
+        # Only the columns and keys relevant to the requirement, so only the instructions are a stable prefix
+        schema = get_retriever(retrieval_config, azure_config).select(schema, user_input)
+        system_prompt = SYSTEM_PROMPT + fit_schema(schema, retrieval_config.get('max_schema_tokens'), retrieval_config.get('tokenizer'))
+    else:
+        system_prompt = build_system_prompt(schema, retrieval_config)
+    # The variable part comes after the system prompt
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_input}
+    ]
+    # Earlier failing queries and their errors, so the model can correct them
+    if feedback:
+        messages.extend(feedback_messages(feedback))
+    return messages
+
+class GenerationStream:
+    """
+    Iterator over the KQL tokens of a streamed query generation.
+
+    Iterate it with ``for`` when the tokens come from the synchronous client
+    and with ``async for`` when they come from the asynchronous one. Once
+    exhausted, ``query`` holds the assembled query,
+    ``time_to_first_token`` / ``total_time`` the latencies in seconds and
+    ``usage`` the token counts of the completion, empty for a cached query.
+    """
+
+    def __init__(self, tokens, started, on_complete=None, usage=None, cached=False):
+        self._tokens = tokens
+        self._started = started
+        self._on_complete = on_complete
+        self.usage = usage if usage is not None else {}
+        self.cached = cached
+        self.query = None
+        self.time_to_first_token = None
+        self.total_time = None
+
+    def _first_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self._started
+            if not self.cached:
+                observe("llm_ttft", self.time_to_first_token)
+
+    def _finish(self, parts):
+        self.query = "".join(parts)
+        self.total_time = time.perf_counter() - self._started
+        if not self.cached:
+            observe("llm_total", self.total_time)
+        if self._on_complete is not None:
+            self._on_complete(self.query)
+
+    def __iter__(self):
+        parts = []
+        for delta in self._tokens:
+            self._first_token()
+            parts.append(delta)
+            yield delta
+        self._finish(parts)
+
+    async def __aiter__(self):
+        parts = []
+        if hasattr(self._tokens, '__aiter__'):
+            async for delta in self._tokens:
+                self._first_token()
+                parts.append(delta)
+                yield delta
+        else:
+            for delta in self._tokens:
+                self._first_token()
+                parts.append(delta)
+                yield delta
+        self._finish(parts)
+
+def _prepare_generation(user_input,azure_config,schema_path=None,retrieval_config=None,cache_config=None,feedback=None):
+    # Returns the cached query, or the messages to send and the callback caching the answer
+    with span("schema_load"):
+        schema = get_schema(schema_path)
+
+    # Reuse the query generated earlier for the same requirement, unless it is being repaired
+    cache = get_generation_cache(cache_config)
+    on_complete = None
+    if cache is not None:
+        cache_key = generation_cache_key(user_input, schema.version, azure_config['deployment_name'])
+        cached_query = None if feedback else cache.get(cache_key)
+        if cached_query is not None:
+            return cached_query, None, None
+
+        def on_complete(query):
+            if query:
+                cache.set(cache_key, query)
+
+    with span("prompt_build"):
+        messages = build_messages(user_input, azure_config, schema, retrieval_config, feedback)
+    return None, messages, on_complete
+
+def stream_kusto_query(user_input,azure_config,schema_path=None,retrieval_config=None,cache_config=None,feedback=None):
+    started = time.perf_counter()
+    cached_query, messages, on_complete = _prepare_generation(user_input,azure_config,schema_path,retrieval_config,cache_config,feedback)
+    if cached_query is not None:
+        return GenerationStream([cached_query], started, cached=True)
+
+    client = get_client(azure_config)
+    started = time.perf_counter()
+    chunks = client.chat.completions.create(
         model = azure_config['deployment_name'],  # 可用 gpt-3.5-turbo
-        messages=[
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": user_input}
-        ]
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    usage = {}
+    return GenerationStream(_content_deltas(chunks, usage), started, on_complete, usage)
+
+async def astream_kusto_query(user_input,azure_config,schema_path=None,retrieval_config=None,cache_config=None,feedback=None):
+    started = time.perf_counter()
+    cached_query, messages, on_complete = _prepare_generation(user_input,azure_config,schema_path,retrieval_config,cache_config,feedback)
+    if cached_query is not None:
+        return GenerationStream([cached_query], started, cached=True)
+
+    client = get_async_client(azure_config)
+    started = time.perf_counter()
+    chunks = await client.chat.completions.create(
+        model = azure_config['deployment_name'],
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True}
     )
+    usage = {}
+    return GenerationStream(_acontent_deltas(chunks, usage), started, on_complete, usage)
+
+def _content_deltas(chunks, usage=None):
+    for chunk in chunks:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+        # The last chunk carries the token usage and no choices
+        if getattr(chunk, 'usage', None) is not None and usage is not None:
+            usage.update(usage_stats.record(chunk.usage))
+
+async def _acontent_deltas(chunks, usage=None):
+    try:
+        async for chunk in chunks:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, 'usage', None) is not None and usage is not None:
+                usage.update(usage_stats.record(chunk.usage))
+    finally:
+        # Release the connection when the caller stops early
+        await chunks.close()
+
+def generate_kusto_query(user_input,azure_config,schema_path=None,retrieval_config=None,cache_config=None,stream=False,on_token=None,feedback=None):
+    if stream:
+        generation = stream_kusto_query(user_input,azure_config,schema_path,retrieval_config,cache_config,feedback)
+        for token in generation:
+            if on_token is not None:
+                on_token(token)
+        return generation.query
+
+    # Repairs carry their own feedback and are never shared
+    if feedback:
+        return _generate_query(user_input,azure_config,schema_path,retrieval_config,cache_config,feedback)
+    return _generation_flights.do(_generation_key(user_input,azure_config,schema_path,retrieval_config),
+                                  _generate_query,user_input,azure_config,schema_path,retrieval_config,cache_config)
+
+def _generation_key(user_input,azure_config,schema_path=None,retrieval_config=None):
+    schema = get_schema(schema_path)
+    return (azure_config['endpoint'], generation_cache_key(user_input, schema.version, azure_config['deployment_name']),
+            bool((retrieval_config or {}).get('enabled')))
+
+def _generate_query(user_input,azure_config,schema_path=None,retrieval_config=None,cache_config=None,feedback=None):
+    cached_query, messages, on_complete = _prepare_generation(user_input,azure_config,schema_path,retrieval_config,cache_config,feedback)
+    if cached_query is not None:
+        return cached_query
+
+    client = get_client(azure_config)
+    with span("llm_total"):
+        response = client.chat.completions.create(
+            model = azure_config['deployment_name'],  # 可用 gpt-3.5-turbo
+            messages=messages
+        )
+    usage_stats.record(response.usage)
     query = response.choices[0].message.content
+    if on_complete is not None:
+        on_complete(query)
     return query
 
-def execute_kusto_query(query,token,app_id):
-    url = f"https://api.applicationinsights.io/v1/apps/{app_id}/query?query={query}"
-    headers = {
-        "Authorization": f"Bearer {token}"
-    }
+async def agenerate_kusto_query(user_input,azure_config,schema_path=None,retrieval_config=None,cache_config=None,feedback=None):
+    # Repairs carry their own feedback and are never shared
+    if feedback:
+        return await _agenerate_query(user_input,azure_config,schema_path,retrieval_config,cache_config,feedback)
+    return await _async_generation_flights.do(_generation_key(user_input,azure_config,schema_path,retrieval_config),
+                                              _agenerate_query,user_input,azure_config,schema_path,retrieval_config,cache_config)
+
+async def _agenerate_query(user_input,azure_config,schema_path=None,retrieval_config=None,cache_config=None,feedback=None):
+    cached_query, messages, on_complete = _prepare_generation(user_input,azure_config,schema_path,retrieval_config,cache_config,feedback)
+    if cached_query is not None:
+        return cached_query
+
+    client = get_async_client(azure_config)
+    with span("llm_total"):
+        response = await client.chat.completions.create(
+            model = azure_config['deployment_name'],
+            messages=messages
+        )
+    usage_stats.record(response.usage)
+    query = response.choices[0].message.content
+    if on_complete is not None:
+        on_complete(query)
+    return query
+
+def forget_generated_query(user_input,azure_config,schema_path=None,cache_config=None):
+    # Drop a cached query that failed, so the requirement is generated afresh next time
+    cache = get_generation_cache(cache_config)
+    if cache is not None:
+        schema = get_schema(schema_path)
+        cache.delete(generation_cache_key(user_input, schema.version, azure_config['deployment_name']))
+
+def post_kusto_query(query,token,app_id,appinsight_config=None,stream=False):
+    client = get_appinsights_client({**(appinsight_config or {}), "app_id": app_id})
+    with span("http"):
+        try:
+            return client.post(query, resolve_token(token), stream=stream)
+        except AppInsightsQueryError as e:
+            # A revoked or expired token is fetched again once
+            if e.status_code != 401 or isinstance(token, str):
+                raise
+            token.invalidate()
+            return client.post(query, resolve_token(token), stream=stream)
+
+def run_kusto_query(query,token,app_id,appinsight_config=None,cache_config=None,bypass_cache=False):
+    # Reuse the result of the same query within the current time bucket
+    cache = None if bypass_cache else get_result_cache(cache_config)
+    if cache is not None:
+        cache_key = result_cache_key(query, app_id, cache_config.get('bucket_seconds'))
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            return cached_response
+
+    def fetch():
+        response = post_kusto_query(query,token,app_id,appinsight_config)
+        with span("decode"):
+            response = response.json()
+
+        if cache is not None:
+            max_rows = cache_config.get('max_rows')
+            if not max_rows or sum(len(table['rows']) for table in response['tables']) <= max_rows:
+                cache.set(cache_key, response)
+        return response
+
+    # Callers sending the same query at the same time share the response, which must not be modified
+    key = ((appinsight_config or {}).get('endpoint'), app_id, canonicalize_query(query))
+    return _query_flights.do(key, fetch)
+
+def query_kusto_table(query,token,app_id,appinsight_config=None,cache_config=None,bypass_cache=False,backend=None):
+    # Decode the primary result into typed columns instead of lists of rows
+    from result_decoder import decode_table
+    response = run_kusto_query(query,token,app_id,appinsight_config,cache_config,bypass_cache)
+    with span("decode"):
+        return decode_table(response['tables'][0], backend)
+
+def stream_kusto_table(query,token,app_id,appinsight_config=None,cache_config=None,bypass_cache=False):
+    # Reuse the result of the same query within the current time bucket
+    cache = None if bypass_cache else get_result_cache(cache_config)
+    if cache is not None:
+        cache_key = result_cache_key(query, app_id, cache_config.get('bucket_seconds'))
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            table = cached_response['tables'][0]
+            return StreamedTable(table.get('name'), table['columns'], iter(table['rows']))
+
+    # Rows are decoded while the body is still downloading
+    response = post_kusto_query(query,token,app_id,appinsight_config,stream=True)
+    tables = stream_response_tables(response)
+    table = next(tables, None)
+    if table is None:
+        tables.close()
+        return StreamedTable(None, [], iter(()))
+
+    def rows():
+        collected = [] if cache is not None else None
+        max_rows = cache_config.get('max_rows') if cache is not None else None
+        #Only the time spent reading and parsing the body counts as decode, not the consumer's
+        decode_time = 0.0
+        iterator = iter(table.rows)
+        try:
+            while True:
+                started = time.perf_counter()
+                row = next(iterator, None)
+                decode_time += time.perf_counter() - started
+                if row is None:
+                    break
+                if collected is not None:
+                    collected.append(row)
+                    if max_rows and len(collected) > max_rows:
+                        collected = None
+                yield row
+        finally:
+            tables.close()
+            observe("decode", decode_time)
+        # Only the primary table of a streamed result is cached
+        if collected is not None:
+            cache.set(cache_key, {"tables": [{"name": table.name, "columns": table.columns, "rows": collected}]})
+
+    return StreamedTable(table.name, table.columns, rows())
+
+def export_kusto_query(query,token,app_id,path,appinsight_config=None,cache_config=None,bypass_cache=False,output_format=None):
+    # Rows go from the response stream to the file in bounded chunks
+    table = stream_kusto_table(query,token,app_id,appinsight_config,cache_config,bypass_cache)
+    with span("output"):
+        return export_rows(table.columns, table.rows, path, output_format)
 
+def execute_kusto_query(query,token,app_id,appinsight_config=None,cache_config=None,bypass_cache=False):
     try:
-        response = requests.get(url, headers=headers).json()
-        table = response['tables'][0]
+        table = stream_kusto_table(query,token,app_id,appinsight_config,cache_config,bypass_cache)
         print("The query result is:\n")
-        for row in table['rows']:
-            print(row)
+        with span("output"):
+            for row in table.rows:
+                print(row)
     except Exception as e:
         print(f"Get exception:{e}")
 
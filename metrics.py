@@ -0,0 +1,243 @@
+"""
+Metrics module for the Kusto Agent.
+
+This module times the stages of a request (schema load, prompt build, LLM
+time to first token and total, HTTP request, response decode and output)
+into histograms, counts token usage, and exports both as Prometheus text,
+over HTTP or to a JSONL file. Stages timed while a :func:`profile` is active
+are also collected into a per-request breakdown.
+"""
+
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGES = ("schema_load", "prompt_build", "llm_ttft", "llm_total", "http", "decode", "output")
+
+_current_profile = contextvars.ContextVar("kusto_agent_profile", default=None)
+
+
+class Histogram:
+    """A Prometheus style histogram with fixed upper bounds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the ``q`` quantile by interpolating within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class MetricsRegistry:
+    """Stage latency histograms, token counters and event counters shared by the process."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = buckets
+        self.histograms = {}
+        self.tokens = {"prompt": 0, "cached": 0, "completion": 0}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self._buckets)
+            histogram.observe(seconds)
+
+    def add_tokens(self, prompt=0, cached=0, completion=0):
+        with self._lock:
+            self.tokens["prompt"] += prompt
+            self.tokens["cached"] += cached
+            self.tokens["completion"] += completion
+
+    def increment(self, name, kind, amount=1):
+        """Add ``amount`` to the ``kusto_agent_<name>_total{kind=...}`` counter."""
+        with self._lock:
+            self.counters[(name, kind)] = self.counters.get((name, kind), 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.tokens = {"prompt": 0, "cached": 0, "completion": 0}
+            self.counters.clear()
+
+    def snapshot(self):
+        """Return the histograms summaries and token counts as a dict."""
+        with self._lock:
+            return {
+                "time": time.time(),
+                "stages": {stage: histogram.snapshot() for stage, histogram in self.histograms.items()},
+                "tokens": dict(self.tokens),
+                "counters": {f"{name}.{kind}": count for (name, kind), count in self.counters.items()},
+            }
+
+    def render_prometheus(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP kusto_agent_stage_seconds Latency of each request stage.",
+            "# TYPE kusto_agent_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f'kusto_agent_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'kusto_agent_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'kusto_agent_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'kusto_agent_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append("# HELP kusto_agent_tokens_total Tokens used by query generation.")
+            lines.append("# TYPE kusto_agent_tokens_total counter")
+            for kind, count in self.tokens.items():
+                lines.append(f'kusto_agent_tokens_total{{kind="{kind}"}} {count}')
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE kusto_agent_{name}_total counter")
+                for (counter_name, kind), count in self.counters.items():
+                    if counter_name == name:
+                        lines.append(f'kusto_agent_{name}_total{{kind="{kind}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, path):
+        """Append a snapshot of the metrics to a JSONL file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+
+registry = MetricsRegistry()
+
+
+class Profile:
+    """The stage timings and token usage of one request."""
+
+    def __init__(self):
+        self.stages = {}
+        self.tokens = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_tokens(self, usage):
+        for kind, count in usage.items():
+            self.tokens[kind] = self.tokens.get(kind, 0) + count
+
+    def to_dict(self):
+        return {"stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+                "tokens": dict(self.tokens)}
+
+    def __str__(self):
+        parts = [f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in self.stages.items()]
+        if self.tokens:
+            parts.append(", ".join(f"{kind} {count}" for kind, count in self.tokens.items()))
+        return " | ".join(parts)
+
+
+@contextmanager
+def profile():
+    """Collect the stages timed in this context into a new Profile."""
+    request_profile = Profile()
+    token = _current_profile.set(request_profile)
+    try:
+        yield request_profile
+    finally:
+        _current_profile.reset(token)
+
+
+def observe(stage, seconds):
+    """Record the duration of a stage in the histograms and the current profile."""
+    registry.observe(stage, seconds)
+    request_profile = _current_profile.get()
+    if request_profile is not None:
+        request_profile.add(stage, seconds)
+
+
+def record_tokens(usage):
+    """
+    Record the token usage of one completion.
+
+    Args:
+        usage (dict): ``prompt_tokens``, ``cached_tokens`` and ``completion_tokens``.
+    """
+    registry.add_tokens(usage.get("prompt_tokens", 0), usage.get("cached_tokens", 0),
+                        usage.get("completion_tokens", 0))
+    request_profile = _current_profile.get()
+    if request_profile is not None:
+        request_profile.add_tokens(usage)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as ``stage``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request: " + format, *args)
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """
+    Serve the metrics at ``/metrics`` from a daemon thread.
+
+    Returns:
+        ThreadingHTTPServer: The server, stopped with ``shutdown()``.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="kusto-metrics", daemon=True)
+    thread.start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
@@ -0,0 +1,197 @@
+"""
+Query guard module for the Kusto Agent.
+
+This module bounds generated Kusto queries before they are sent: a query
+whose source table is not filtered on its time column gets
+``| where timestamp > ago(24h)`` after the table, and a query without a
+``take``, ``limit``, ``top``, ``sample``, ``count`` or ungrouped
+``summarize`` gets ``| take 10000`` before any ``render``. Without a time
+filter App Insights scans the whole retention window of the table.
+
+Queries that bound themselves are left as they are, so the defaults only
+apply when the model left the bound out. Set ``time_range`` or ``row_limit``
+to ``None`` in the ``query_guard`` configuration to skip one of them, or
+``enabled`` to ``False`` to send queries unchanged.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import List
+
+from kql_validator import check_query, clean_query, tokenize
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIME_COLUMN = "timestamp"
+DEFAULT_TIME_RANGE = "24h"
+DEFAULT_ROW_LIMIT = 10000
+
+_FILTER_OPERATORS = frozenset({"where", "filter"})
+_LIMIT_OPERATORS = frozenset({"take", "limit", "top", "sample", "count"})
+_OPENING = frozenset({"(", "[", "{"})
+_CLOSING = frozenset({")", "]", "}"})
+
+
+@dataclass
+class GuardResult:
+    """A query and the bounds added to it."""
+
+    query: str
+    added: List[str] = field(default_factory=list)
+
+    @property
+    def changed(self):
+        return bool(self.added)
+
+
+def _main_statement(tokens):
+    # The last statement is the one returning the result, earlier ones are lets and sets
+    start = 0
+    for i, token in enumerate(tokens):
+        if token.text == ";" and i + 1 < len(tokens):
+            start = i + 1
+    end = len(tokens)
+    while end > start and tokens[end - 1].text == ";":
+        end -= 1
+    return tokens[start:end]
+
+
+def _segments(statement):
+    """Split a statement at its top-level pipes into lists of tokens."""
+    segments = [[]]
+    depth = 0
+    for token in statement:
+        if token.text in _OPENING:
+            depth += 1
+        elif token.text in _CLOSING:
+            depth = max(depth - 1, 0)
+        elif token.text == "|" and depth == 0:
+            segments.append([])
+            continue
+        segments[-1].append(token)
+    return segments
+
+
+def _operator(segment):
+    return segment[0].text if segment and segment[0].kind == "ident" else None
+
+
+def _has_time_filter(segments, time_column):
+    return any(
+        _operator(segment) in _FILTER_OPERATORS
+        and any(token.kind == "ident" and token.text == time_column for token in segment)
+        for segment in segments[1:]
+    )
+
+
+def _has_row_limit(segments):
+    for segment in segments[1:]:
+        operator = _operator(segment)
+        if operator in _LIMIT_OPERATORS:
+            return True
+        # An aggregation without grouping returns a single row
+        if operator == "summarize" and not any(token.text == "by" for token in segment):
+            return True
+    return False
+
+
+def _source_table(segments, tokens, schema, time_column):
+    # Only a plain table the query reads directly can be filtered after its name
+    source = segments[0]
+    if len(source) != 1 or source[0].kind != "ident":
+        return None
+    name = source[0].text
+    defined = {tokens[i + 1].text for i, token in enumerate(tokens[:-1]) if token.text == "let"}
+    if name in defined:
+        return None
+    if schema is not None:
+        table = schema.table(name)
+        if table is None or not table.has_column(time_column):
+            return None
+    return source[0]
+
+
+def _end(token):
+    return token.position + len(token.text)
+
+
+def guard_query(query, guard_config=None, schema=None):
+    """
+    Add a time filter and a row limit to a query missing them.
+
+    Args:
+        query (str): The KQL text, optionally wrapped in a Markdown code fence.
+        guard_config (dict, optional): The ``query_guard`` section of the
+            configuration: ``enabled``, ``time_column``, ``time_range``, an
+            ``ago()`` timespan such as ``24h``, and ``row_limit``. Without
+            it the query is returned unchanged.
+        schema (Schema, optional): The parsed schema. When given, the time
+            filter is only added to tables that have the time column.
+
+    Returns:
+        GuardResult: The query to send and the bounds that were added.
+    """
+    query = clean_query(query)
+    if not guard_config or not guard_config.get("enabled", True):
+        return GuardResult(query)
+    time_column = guard_config.get("time_column") or DEFAULT_TIME_COLUMN
+    time_range = guard_config.get("time_range", DEFAULT_TIME_RANGE)
+    row_limit = guard_config.get("row_limit", DEFAULT_ROW_LIMIT)
+
+    tokens = tokenize(query)
+    statement = _main_statement(tokens)
+    if not statement:
+        return GuardResult(query)
+    segments = _segments(statement)
+    insertions = []
+    added = []
+
+    if row_limit and not _has_row_limit(segments):
+        clause = f"take {int(row_limit)}"
+        # render has to stay the last operator
+        render = next((segment for segment in segments[1:] if _operator(segment) == "render"), None)
+        if render is not None:
+            pipe = max(token.position for token in statement
+                       if token.text == "|" and token.position < render[0].position)
+            insertions.append((pipe, 1, f"| {clause} "))
+        else:
+            insertions.append((_end(statement[-1]), 1, f" | {clause}"))
+        added.append(clause)
+        registry.increment("guarded", "row_limit")
+
+    if time_range and not _has_time_filter(segments, time_column):
+        source = _source_table(segments, tokens, schema, time_column)
+        if source is not None:
+            clause = f"where {time_column} > ago({time_range})"
+            insertions.append((_end(source), 0, f" | {clause}"))
+            added.insert(0, clause)
+            registry.increment("guarded", "time_range")
+
+    # From the end, so earlier positions stay valid, and the time filter before the limit at the same position
+    for position, _, text in sorted(insertions, reverse=True):
+        query = query[:position] + text + query[position:]
+    if added:
+        logger.info("Bounded the query with %s", ", ".join(added))
+    return GuardResult(query, added)
+
+
+def prepare_query(query, schema, validation_config=None, guard_config=None):
+    """
+    Validate a query when validation is enabled, then bound it, see :func:`guard_query`.
+
+    Args:
+        query (str): The KQL text, optionally wrapped in a Markdown code fence.
+        schema (Schema): The parsed schema.
+        validation_config (dict, optional): The ``validation`` section of the configuration.
+        guard_config (dict, optional): The ``query_guard`` section of the configuration.
+
+    Returns:
+        GuardResult: The query to send and the bounds that were added.
+
+    Raises:
+        KqlValidationError: If validation is enabled and the query is invalid.
+    """
+    if (validation_config or {}).get("enabled"):
+        query = check_query(query, schema)
+    return guard_query(query, guard_config, schema)
@@ -0,0 +1,152 @@
+"""
+Query repair module for the Kusto Agent.
+
+When a generated query is rejected by the validator or by Application
+Insights, this module feeds the failing query and the error back into
+generation and tries again, within a retry budget and a deadline.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+from appinsights import AppInsightsQueryError
+from kql_validator import KqlValidationError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_DEADLINE = 60.0
+
+
+@dataclass(frozen=True)
+class RepairAttempt:
+    """A generated query and the error it failed with, None if it succeeded."""
+
+    query: str
+    error: Optional[str] = None
+
+
+@dataclass
+class RepairOutcome:
+    """The query that finally succeeded, its result and every attempt made."""
+
+    query: str
+    result: Any
+    attempts: List[RepairAttempt] = field(default_factory=list)
+
+
+class RepairExhaustedError(Exception):
+    """Raised when no attempt succeeded within the retry budget or deadline."""
+
+    def __init__(self, attempts):
+        super().__init__(f"Query still failing after {len(attempts)} attempts: {attempts[-1].error}")
+        self.attempts = attempts
+
+
+def is_repairable(error):
+    """Return whether an error can be fixed by regenerating the query."""
+    if isinstance(error, KqlValidationError):
+        return True
+    return isinstance(error, AppInsightsQueryError) and error.status_code == 400
+
+
+def feedback_messages(attempts):
+    """
+    Build the chat messages telling the model why its previous queries failed.
+
+    Args:
+        attempts (list): The failed RepairAttempt objects, oldest first.
+
+    Returns:
+        list: Alternating assistant and user messages.
+    """
+    messages = []
+    for attempt in attempts:
+        messages.append({"role": "assistant", "content": attempt.query})
+        messages.append({
+            "role": "user",
+            "content": f"The query failed with this error:\n{attempt.error}\n"
+                       "Return only the corrected Kusto query.",
+        })
+    return messages
+
+
+def _should_stop(attempts, started, max_attempts, deadline):
+    if len(attempts) >= max_attempts:
+        return True
+    return bool(deadline) and time.monotonic() - started >= deadline
+
+
+def run_with_repair(generate, execute, validate=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                    deadline=DEFAULT_DEADLINE, on_error=None):
+    """
+    Generate and execute a query, regenerating it while it fails repairably.
+
+    Args:
+        generate (callable): Takes the list of failed attempts and returns a query.
+        execute (callable): Takes a query and returns its result.
+        validate (callable, optional): Takes a query and returns it cleaned,
+            raising KqlValidationError if it is invalid.
+        max_attempts (int, optional): Attempts in total, including the first.
+        deadline (float, optional): Seconds after which no new attempt starts.
+        on_error (callable, optional): Called with each failed RepairAttempt.
+
+    Returns:
+        RepairOutcome: The successful query, its result and all attempts.
+
+    Raises:
+        RepairExhaustedError: If every attempt failed repairably.
+    """
+    if max_attempts is None:
+        max_attempts = DEFAULT_MAX_ATTEMPTS
+    attempts = []
+    started = time.monotonic()
+    while True:
+        query = generate(attempts)
+        try:
+            if validate is not None:
+                query = validate(query)
+            result = execute(query)
+        except Exception as e:
+            if not is_repairable(e):
+                raise
+            attempt = RepairAttempt(query, str(e))
+            attempts.append(attempt)
+            logger.info("Attempt %d failed: %s", len(attempts), attempt.error)
+            if on_error is not None:
+                on_error(attempt)
+            if _should_stop(attempts, started, max_attempts, deadline):
+                raise RepairExhaustedError(attempts) from e
+            continue
+        return RepairOutcome(query, result, attempts + [RepairAttempt(query)])
+
+
+async def arun_with_repair(generate, execute, validate=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                           deadline=DEFAULT_DEADLINE, on_error=None):
+    """
+    Asynchronous :func:`run_with_repair`, for coroutine ``generate`` and ``execute``.
+    """
+    if max_attempts is None:
+        max_attempts = DEFAULT_MAX_ATTEMPTS
+    attempts = []
+    started = time.monotonic()
+    while True:
+        query = await generate(attempts)
+        try:
+            if validate is not None:
+                query = validate(query)
+            result = await execute(query)
+        except Exception as e:
+            if not is_repairable(e):
+                raise
+            attempt = RepairAttempt(query, str(e))
+            attempts.append(attempt)
+            logger.info("Attempt %d failed: %s", len(attempts), attempt.error)
+            if on_error is not None:
+                on_error(attempt)
+            if _should_stop(attempts, started, max_attempts, deadline):
+                raise RepairExhaustedError(attempts) from e
+            continue
+        return RepairOutcome(query, result, attempts + [RepairAttempt(query)])
@@ -0,0 +1,203 @@
+"""
+Streaming response parser module for the Kusto Agent.
+
+This module parses an Application Insights query response incrementally from
+its body chunks and yields result rows as soon as they are decoded, so memory
+stays bounded by the size of one row rather than the size of the result.
+"""
+
+import codecs
+import json
+import logging
+
+from dynamic_values import lazy_rows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+_WHITESPACE = " \t\n\r"
+
+
+class StreamedTable:
+    """
+    A result table whose rows are decoded while they are read.
+
+    ``rows`` can be iterated once. A response's tables must be consumed in
+    order: moving on to the next table skips the rows left in this one.
+
+    Attributes:
+        name (str): The table name, usually ``PrimaryResult``.
+        columns (list): The ``{"name", "type"}`` column descriptions.
+    """
+
+    def __init__(self, name, columns, rows):
+        self.name = name
+        self.columns = columns
+        self.rows = rows
+
+    @property
+    def column_names(self):
+        return [column["name"] for column in self.columns or ()]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def lazy_rows(self):
+        """Iterate the rows as LazyRow, parsing dynamic cells only when read."""
+        return lazy_rows(self.columns or [], self.rows)
+
+
+class _Scanner:
+    """Incremental JSON reader over an iterator of byte or text chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            try:
+                self._buffer += self._decoder.decode(b"", final=True)
+            except UnicodeDecodeError as e:
+                raise ValueError("Unexpected end of response body inside a UTF-8 character") from e
+            return False
+        if isinstance(chunk, bytes):
+            try:
+                chunk = self._decoder.decode(chunk)
+            except UnicodeDecodeError as e:
+                raise ValueError(f"Response body is not valid UTF-8: {e.reason}") from e
+        if self._pos > DEFAULT_CHUNK_SIZE:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        self._buffer += chunk
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of response body")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self._pos}, got {self._buffer[self._pos]!r}")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise ValueError(f"Invalid or truncated response body at offset {e.pos}: {e.msg}") from e
+            # A number or literal ending at the buffer end may continue in the next chunk
+            if end == len(self._buffer) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def members(self):
+        """Iterate the keys of an object, leaving the scanner on each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def items(self):
+        """Iterate the elements of an array, leaving the scanner on each element."""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def _table_rows(scanner, state):
+    for _ in scanner.items():
+        yield scanner.value()
+    state["consumed"] = True
+
+
+def stream_tables(chunks):
+    """
+    Parse a query response body incrementally.
+
+    The response must be consumed in order. Table metadata that appears after
+    the rows of a table is not available while they are read.
+
+    Args:
+        chunks: An iterator of byte or text chunks of the response body.
+
+    Yields:
+        StreamedTable: Each table of the response.
+    """
+    scanner = _Scanner(chunks)
+    for key in scanner.members():
+        if key != "tables":
+            scanner.value()
+            continue
+        for _ in scanner.items():
+            name = None
+            columns = None
+            for table_key in scanner.members():
+                if table_key == "rows":
+                    state = {"consumed": False}
+                    rows = _table_rows(scanner, state)
+                    yield StreamedTable(name, columns, rows)
+                    if not state["consumed"]:
+                        for _ in rows:
+                            pass
+                elif table_key == "name":
+                    name = scanner.value()
+                elif table_key == "columns":
+                    columns = scanner.value()
+                else:
+                    scanner.value()
+
+
+def stream_response_tables(response, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Parse a streamed ``requests`` response incrementally.
+
+    Args:
+        response (requests.Response): A response opened with ``stream=True``.
+        chunk_size (int, optional): Bytes read from the socket at a time.
+
+    Yields:
+        StreamedTable: Each table of the response.
+    """
+    try:
+        yield from stream_tables(response.iter_content(chunk_size=chunk_size))
+    finally:
+        response.close()
@@ -0,0 +1,248 @@
+"""
+Result decoding module for the Kusto Agent.
+
+This module converts the row-oriented tables returned by the Application
+Insights query API into typed columns, using the ``columns`` type metadata of
+the response. Columns are backed by NumPy arrays or Arrow arrays when those
+libraries are installed and by typed ``array.array`` buffers otherwise.
+"""
+
+import array
+import logging
+
+from dynamic_values import extract_key, extract_keys
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+# App Insights column types mapped to NumPy dtypes, Arrow types and array.array typecodes
+_NUMPY_TYPES = {
+    "int": "int32",
+    "long": "int64",
+    "real": "float64",
+    "double": "float64",
+    "decimal": "float64",
+    "bool": "bool",
+    "boolean": "bool",
+    "datetime": "datetime64[ns]",
+}
+_ARRAY_TYPECODES = {"int": "i", "long": "q", "real": "d", "double": "d", "decimal": "d"}
+
+
+def _arrow_type(column_type):
+    return {
+        "int": pa.int32(),
+        "long": pa.int64(),
+        "real": pa.float64(),
+        "double": pa.float64(),
+        "decimal": pa.float64(),
+        "bool": pa.bool_(),
+        "boolean": pa.bool_(),
+        "datetime": pa.timestamp("ns", tz="UTC"),
+    }.get(column_type, pa.string())
+
+
+def available_backends():
+    """Return the decoding backends usable in this environment, best first."""
+    backends = []
+    if pa is not None:
+        backends.append("arrow")
+    if np is not None:
+        backends.append("numpy")
+    backends.append("python")
+    return backends
+
+
+class ColumnarTable:
+    """
+    A decoded result table holding one typed array per column.
+
+    Attributes:
+        name (str): The table name, usually ``PrimaryResult``.
+        columns (dict): Arrays by column name, in result order.
+        types (dict): App Insights column types by column name.
+        backend (str): ``arrow``, ``numpy`` or ``python``.
+    """
+
+    def __init__(self, name, columns, types, backend, num_rows):
+        self.name = name
+        self.columns = columns
+        self.types = types
+        self.backend = backend
+        self.num_rows = num_rows
+
+    def __len__(self):
+        return self.num_rows
+
+    def __getitem__(self, column_name):
+        return self.columns[column_name]
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    def extract_key(self, column_name, key, default=None):
+        """
+        Extract one key of a dynamic column across all rows.
+
+        Only the cells mentioning ``key`` are parsed.
+
+        Returns:
+            list: The values of ``key``, one per row.
+        """
+        return extract_key(self._raw_values(column_name), key, default)
+
+    def extract_keys(self, column_name, keys, default=None):
+        """Extract several keys of a dynamic column, see :meth:`extract_key`."""
+        return extract_keys(self._raw_values(column_name), keys, default)
+
+    def _raw_values(self, column_name):
+        values = self.columns[column_name]
+        if self.backend == "arrow":
+            return values.to_pylist()
+        return values
+
+    def to_arrow(self):
+        """Return the table as a ``pyarrow.Table``."""
+        if pa is None:
+            raise ImportError("pyarrow is required for to_arrow()")
+        arrays = []
+        for name, values in self.columns.items():
+            if self.backend == "arrow":
+                arrays.append(values)
+            else:
+                arrays.append(_to_arrow_array(values, self.types[name]))
+        return pa.Table.from_arrays(arrays, names=self.column_names)
+
+    def to_pandas(self):
+        """Return the table as a ``pandas.DataFrame``."""
+        return self.to_arrow().to_pandas()
+
+    def to_numpy(self):
+        """Return the columns as a dict of NumPy arrays."""
+        if np is None:
+            raise ImportError("numpy is required for to_numpy()")
+        if self.backend == "numpy":
+            return dict(self.columns)
+        if self.backend == "arrow":
+            return {name: values.to_numpy(zero_copy_only=False) for name, values in self.columns.items()}
+        return {name: _decode_numpy(list(values), self.types[name]) for name, values in self.columns.items()}
+
+    def save(self, path):
+        """
+        Export the table to ``path``.
+
+        ``.parquet`` and ``.arrow``/``.feather`` files need pyarrow, ``.npz``
+        files need NumPy.
+        """
+        if path.endswith(".npz"):
+            np.savez_compressed(path, **self.to_numpy())
+        elif path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+
+            pq.write_table(self.to_arrow(), path)
+        elif path.endswith((".arrow", ".feather")):
+            import pyarrow.feather as feather
+
+            feather.write_feather(self.to_arrow(), path)
+        else:
+            raise ValueError(f"Unsupported export format: {path}")
+
+
+def _strip_utc(value):
+    if value is None:
+        return "NaT"
+    return value[:-1] if value.endswith("Z") else value
+
+
+def _decode_numpy(values, column_type):
+    dtype = _NUMPY_TYPES.get(column_type)
+    if dtype == "datetime64[ns]":
+        return np.array([_strip_utc(value) for value in values], dtype=dtype)
+    if dtype is None:
+        return np.array(values, dtype=object)
+    if dtype == "float64":
+        return np.array([np.nan if value is None else value for value in values], dtype=dtype)
+    if None in values:
+        mask = [value is None for value in values]
+        filled = [0 if value is None else value for value in values]
+        return np.ma.MaskedArray(np.array(filled, dtype=dtype), mask=mask)
+    return np.array(values, dtype=dtype)
+
+
+def _to_arrow_array(values, column_type):
+    arrow_type = _arrow_type(column_type)
+    if column_type == "datetime":
+        if np is not None and isinstance(values, np.ndarray):
+            return pa.array(values, mask=np.isnat(values)).cast(arrow_type)
+        values = np.array([_strip_utc(value) for value in values], dtype="datetime64[ns]")
+        return pa.array(values, mask=np.isnat(values)).cast(arrow_type)
+    if np is not None and isinstance(values, np.ma.MaskedArray):
+        return pa.array(values.data, mask=values.mask, type=arrow_type)
+    if np is not None and isinstance(values, np.ndarray) and values.dtype != object:
+        return pa.array(values, type=arrow_type, from_pandas=True)
+    return pa.array(list(values), type=arrow_type)
+
+
+def _decode_arrow(values, column_type):
+    if column_type == "datetime":
+        return _to_arrow_array(values, column_type)
+    return pa.array(values, type=_arrow_type(column_type))
+
+
+def _decode_python(values, column_type):
+    typecode = _ARRAY_TYPECODES.get(column_type)
+    if typecode is not None and None not in values:
+        return array.array(typecode, values)
+    return values
+
+
+def decode_table(table, backend=None):
+    """
+    Decode one table of an App Insights response into typed columns.
+
+    Args:
+        table (dict): A ``tables`` entry with ``name``, ``columns`` and ``rows``.
+        backend (str, optional): ``arrow``, ``numpy`` or ``python``; defaults
+            to the best one installed.
+
+    Returns:
+        ColumnarTable: The decoded table.
+    """
+    backend = backend or available_backends()[0]
+    if backend not in available_backends():
+        raise ImportError(f"The {backend} decoding backend is not installed")
+    decode = {"arrow": _decode_arrow, "numpy": _decode_numpy, "python": _decode_python}[backend]
+
+    rows = table["rows"]
+    names = [column["name"] for column in table["columns"]]
+    types = {column["name"]: column["type"] for column in table["columns"]}
+    transposed = list(zip(*rows)) if rows else [()] * len(names)
+    columns = {
+        name: decode(list(values), types[name])
+        for name, values in zip(names, transposed)
+    }
+    return ColumnarTable(table.get("name"), columns, types, backend, len(rows))
+
+
+def decode_response(response, backend=None):
+    """
+    Decode every table of an App Insights response.
+
+    Args:
+        response (dict): The decoded JSON body of a query response.
+        backend (str, optional): See :func:`decode_table`.
+
+    Returns:
+        list: One ColumnarTable per response table.
+    """
+    return [decode_table(table, backend) for table in response["tables"]]
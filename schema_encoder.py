@@ -0,0 +1,138 @@
+"""
+Schema encoding module for the Kusto Agent.
+
+This module renders a parsed schema compactly for the system prompt, one
+``table(column:type, ...)`` line per table followed by the deduplicated keys
+of its dynamic columns, counts prompt tokens and trims the lowest priority
+entries when the schema does not fit a token budget.
+"""
+
+import functools
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from schema_registry import Schema
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+DEFAULT_ENCODING = "o200k_base"
+
+# Approximates BPE splits of identifiers when tiktoken is not installed
+_ESTIMATE_PATTERN = re.compile(r" ?[A-Z]+(?![a-z])| ?[A-Z]?[a-z]+|\d{1,3}|[^\w\s]|_|[\t\n]+")
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(name):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning("Could not load tokenizer %s, estimating token counts: %s", name, e)
+        return None
+
+
+def count_tokens(text: str, encoding: str = DEFAULT_ENCODING) -> int:
+    """
+    Count the tokens of ``text``.
+
+    Uses the tiktoken ``encoding`` when tiktoken is installed and a close
+    estimate otherwise.
+    """
+    tokenizer = _encoding(encoding or DEFAULT_ENCODING)
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    return len(_ESTIMATE_PATTERN.findall(text))
+
+
+def _entries(schema: Schema) -> List[Tuple]:
+    # Columns rank above dynamic keys, so a kept key always has its column
+    columns = []
+    keys = []
+    for table in schema.tables.values():
+        for column in table.columns:
+            columns.append((table.name, column.name, None))
+        for column_name, column_keys in table.dynamic_keys.items():
+            for key in dict.fromkeys(column_keys):
+                keys.append((table.name, column_name, key))
+    return columns + keys
+
+
+def _render(schema: Schema, entries) -> str:
+    selected_columns = {}
+    selected_keys = {}
+    for table_name, column_name, key in entries:
+        if key is None:
+            selected_columns.setdefault(table_name, set()).add(column_name)
+        else:
+            selected_keys.setdefault((table_name, column_name), []).append(key)
+
+    lines = []
+    for table in schema.tables.values():
+        names = selected_columns.get(table.name)
+        if not names:
+            continue
+        columns = ", ".join(f"{column.name}:{column.column_type}" for column in table.columns
+                            if column.name in names)
+        lines.append(f"{table.name}({columns})")
+        for column_name in table.dynamic_keys:
+            keys = selected_keys.get((table.name, column_name))
+            if keys:
+                lines.append(f"{table.name}.{column_name} keys: {', '.join(keys)}")
+    return "\n".join(lines)
+
+
+def encode_schema(schema: Schema) -> str:
+    """
+    Render a schema compactly for the prompt.
+
+    Example::
+
+        customEvents(timestamp:datetime, name:string, customDimensions:dynamic)
+        customEvents.customDimensions keys: JobId, Status
+
+    Args:
+        schema (Schema): The schema, or a subset of it, to render.
+
+    Returns:
+        str: The compact schema text.
+    """
+    return _render(schema, _entries(schema))
+
+
+def fit_schema(schema: Schema, max_tokens: Optional[int] = None, encoding: str = DEFAULT_ENCODING) -> str:
+    """
+    Render a schema compactly within a token budget.
+
+    Entries are dropped lowest priority first: dynamic column keys from the
+    last one, then columns from the last one.
+
+    Args:
+        schema (Schema): The schema, or a subset of it, to render.
+        max_tokens (int, optional): The token budget, unlimited when unset.
+        encoding (str, optional): The tiktoken encoding used to count tokens.
+
+    Returns:
+        str: The compact schema text.
+    """
+    entries = _entries(schema)
+    text = _render(schema, entries)
+    if not max_tokens or count_tokens(text, encoding) <= max_tokens:
+        return text
+
+    # The longest prefix of the priority order that fits
+    low, high = 0, len(entries) - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(_render(schema, entries[:middle]), encoding) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    logger.info("Schema trimmed to %d of %d entries to fit %d tokens", low, len(entries), max_tokens)
+    return _render(schema, entries[:low])
@@ -0,0 +1,252 @@
+"""
+Schema registry module for the Kusto Agent.
+
+This module parses kusto_schema.txt once into an in-memory index of tables,
+typed columns and dynamic column keys, and reloads it only when the file's
+modification time changes.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kusto_schema.txt")
+
+_TABLE_HEADER = "columns of "
+_KEYS_HEADER = "keys for "
+
+
+@dataclass(frozen=True)
+class Column:
+    """A single typed column of a Kusto table."""
+
+    name: str
+    data_type: str
+    column_type: str
+
+    @property
+    def is_dynamic(self) -> bool:
+        return self.column_type == "dynamic"
+
+
+@dataclass(frozen=True)
+class Table:
+    """A Kusto table with its columns and the known keys of its dynamic columns."""
+
+    name: str
+    columns: Tuple[Column, ...]
+    dynamic_keys: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        object.__setattr__(self, "_by_name", {column.name: column for column in self.columns})
+        object.__setattr__(
+            self, "_key_sets", {name: frozenset(keys) for name, keys in self.dynamic_keys.items()}
+        )
+
+    def column(self, name: str) -> Optional[Column]:
+        """Return the column called ``name`` (case-sensitive), or None."""
+        return self._by_name.get(name)
+
+    def has_column(self, name: str) -> bool:
+        return name in self._by_name
+
+    def keys_for(self, column_name: str) -> Tuple[str, ...]:
+        """Return the known keys of the dynamic column ``column_name``."""
+        return self.dynamic_keys.get(column_name, ())
+
+    def has_key(self, column_name: str, key: str) -> bool:
+        return key in self._key_sets.get(column_name, ())
+
+
+@dataclass(frozen=True)
+class Schema:
+    """The parsed contents of a schema file."""
+
+    tables: Dict[str, Table]
+    text: str
+    version: str
+
+    def table(self, name: str) -> Optional[Table]:
+        """Return the table called ``name`` (case-sensitive), or None."""
+        return self.tables.get(name)
+
+    def has_table(self, name: str) -> bool:
+        return name in self.tables
+
+
+def parse_schema(text: str) -> Schema:
+    """
+    Parse the contents of a schema file.
+
+    The file is made of ``Columns of <table>:`` sections with tab separated
+    ``ColumnName DataType ColumnType`` rows, followed by optional
+    ``keys for <column>:`` sections listing one key per line. Key sections
+    belong to the table declared most recently.
+
+    Args:
+        text (str): The schema file contents.
+
+    Returns:
+        Schema: The parsed schema.
+    """
+    tables = {}
+    current_table = None
+    columns = []
+    dynamic_keys = {}
+    keys_column = None
+
+    def flush():
+        if current_table is not None:
+            tables[current_table] = Table(
+                name=current_table,
+                columns=tuple(columns),
+                dynamic_keys={name: tuple(keys) for name, keys in dynamic_keys.items()},
+            )
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        lowered = line.lower()
+        if lowered.startswith(_TABLE_HEADER):
+            flush()
+            current_table = line[len(_TABLE_HEADER):].rstrip(":").strip()
+            columns = []
+            dynamic_keys = {}
+            keys_column = None
+        elif lowered.startswith(_KEYS_HEADER):
+            keys_column = line[len(_KEYS_HEADER):].rstrip(":").strip()
+            dynamic_keys.setdefault(keys_column, [])
+        elif keys_column is not None:
+            if line not in dynamic_keys[keys_column]:
+                dynamic_keys[keys_column].append(line)
+        elif current_table is not None:
+            parts = [part.strip() for part in raw_line.split("\t") if part.strip()]
+            if len(parts) < 3 or parts[0] == "ColumnName":
+                continue
+            columns.append(Column(name=parts[0], data_type=parts[1], column_type=parts[2]))
+    flush()
+
+    version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    return Schema(tables=tables, text=text, version=version)
+
+
+def render_schema(schema: Schema) -> str:
+    """
+    Render a schema back into the kusto_schema.txt layout.
+
+    Args:
+        schema (Schema): The schema, or a subset of it, to render.
+
+    Returns:
+        str: The schema text.
+    """
+    return _render_tables(schema.tables)
+
+
+def _render_tables(tables):
+    lines = []
+    for table in tables.values():
+        lines.append(f"Columns of {table.name}:")
+        lines.append("ColumnName\tDataType\tColumnType")
+        for column in table.columns:
+            lines.append(f"{column.name}\t{column.data_type}\t{column.column_type}")
+        for column_name, keys in table.dynamic_keys.items():
+            if keys:
+                lines.append(f"keys for {column_name}:")
+                lines.extend(keys)
+    return "\n".join(lines)
+
+
+def subset_schema(schema: Schema, columns: Dict[str, set], keys: Dict[Tuple[str, str], set]) -> Schema:
+    """
+    Build a schema holding only some columns and dynamic keys of another.
+
+    The original column and key order is preserved. Tables without any
+    selected column are dropped.
+
+    Args:
+        schema (Schema): The full schema.
+        columns (dict): Selected column names, by table name.
+        keys (dict): Selected keys, by ``(table name, column name)``.
+
+    Returns:
+        Schema: The subset, sharing the version of ``schema``.
+    """
+    tables = {}
+    for table in schema.tables.values():
+        selected = columns.get(table.name)
+        if not selected:
+            continue
+        dynamic_keys = {}
+        for column_name, column_keys in table.dynamic_keys.items():
+            wanted = keys.get((table.name, column_name))
+            if wanted and column_name in selected:
+                dynamic_keys[column_name] = tuple(key for key in column_keys if key in wanted)
+        tables[table.name] = Table(
+            name=table.name,
+            columns=tuple(column for column in table.columns if column.name in selected),
+            dynamic_keys=dynamic_keys,
+        )
+    return Schema(tables=tables, text=_render_tables(tables), version=schema.version)
+
+
+class SchemaRegistry:
+    """
+    Process-wide holder of a parsed schema file.
+
+    The file is parsed on first access and re-parsed only when its
+    modification time changes.
+    """
+
+    def __init__(self, path: str = DEFAULT_SCHEMA_PATH):
+        self.path = path
+        self._schema = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Schema:
+        """Return the current schema, reloading it if the file has changed."""
+        mtime = os.stat(self.path).st_mtime_ns
+        if self._schema is not None and mtime == self._mtime:
+            return self._schema
+        with self._lock:
+            if self._schema is None or mtime != self._mtime:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._schema = parse_schema(f.read())
+                self._mtime = mtime
+                logger.info("Loaded schema %s (version %s)", self.path, self._schema.version)
+        return self._schema
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(path: Optional[str] = None) -> SchemaRegistry:
+    """
+    Get the shared registry for a schema file.
+
+    Args:
+        path (str, optional): Path to the schema file. Defaults to the
+            kusto_schema.txt shipped next to this module.
+
+    Returns:
+        SchemaRegistry: The registry for ``path``.
+    """
+    path = os.path.abspath(path or DEFAULT_SCHEMA_PATH)
+    with _registries_lock:
+        registry = _registries.get(path)
+        if registry is None:
+            registry = _registries[path] = SchemaRegistry(path)
+    return registry
+
+
+def get_schema(path: Optional[str] = None) -> Schema:
+    """Return the current schema for ``path``, see :func:`get_registry`."""
+    return get_registry(path).get()
@@ -0,0 +1,323 @@
+"""
+Schema retrieval module for the Kusto Agent.
+
+This module chunks the parsed schema into one entry per column and per
+dynamic column key, embeds the chunks into an index persisted on disk, and
+selects only the entries relevant to a user requirement so the prompt does
+not have to carry the whole schema.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+from schema_registry import Schema, subset_schema
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".kusto_index")
+DEFAULT_TOP_K_COLUMNS = 12
+DEFAULT_TOP_K_KEYS = 20
+DEFAULT_ALWAYS_INCLUDE = ("timestamp", "name")
+
+_WORD_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text and identifiers into lower-case words.
+
+    ``EnrichmentLatencyInSeconds`` and ``operation_Name`` are split on case
+    changes and underscores, and a trailing plural ``s`` is dropped so that
+    "jobs" matches ``JobId``.
+    """
+    words = []
+    for word in _WORD_PATTERN.findall(text):
+        word = word.lower()
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+class HashingEmbedder:
+    """
+    Offline embedder hashing words and character trigrams into a fixed vector.
+
+    It needs no network access or model and is used whenever no other
+    embedder is configured or the configured one fails.
+    """
+
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def _bucket(self, feature: str) -> int:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.dimensions
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            vector = [0.0] * self.dimensions
+            for word in tokenize(text):
+                vector[self._bucket("w:" + word)] += 1.0
+                padded = f"#{word}#"
+                for i in range(len(padded) - 2):
+                    vector[self._bucket("t:" + padded[i:i + 3])] += 0.3
+            vectors.append(_normalize(vector))
+        return vectors
+
+
+class AzureOpenAIEmbedder:
+    """
+    Embedder calling an Azure OpenAI embeddings deployment.
+
+    Args:
+        azure_config (dict): The ``azure_openai`` section of the configuration.
+        deployment (str): The name of the embeddings deployment.
+    """
+
+    batch_size = 256
+
+    def __init__(self, azure_config: dict, deployment: str):
+        self.azure_config = azure_config
+        self.deployment = deployment
+        self.name = f"azure-{deployment}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        from llm_client import get_client
+
+        client = get_client(self.azure_config)
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = client.embeddings.create(
+                model=self.deployment, input=texts[start:start + self.batch_size]
+            )
+            vectors.extend(_normalize(item.embedding) for item in response.data)
+        return vectors
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(value * value for value in vector))
+    if not norm:
+        return list(vector)
+    return [value / norm for value in vector]
+
+
+def _dot(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+@dataclass(frozen=True)
+class SchemaChunk:
+    """A retrievable schema entry: a column, or a key of a dynamic column."""
+
+    kind: str
+    table: str
+    name: str
+    column: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        return " ".join(tokenize(self.name))
+
+
+def chunk_schema(schema: Schema) -> List[SchemaChunk]:
+    """Split a schema into one chunk per column and per dynamic column key."""
+    chunks = []
+    for table in schema.tables.values():
+        for column in table.columns:
+            chunks.append(SchemaChunk(kind="column", table=table.name, name=column.name))
+        for column_name, keys in table.dynamic_keys.items():
+            for key in keys:
+                chunks.append(SchemaChunk(kind="key", table=table.name, name=key, column=column_name))
+    return chunks
+
+
+class SchemaIndex:
+    """Embedded schema chunks for one schema version and embedder."""
+
+    def __init__(self, chunks, vectors, schema_version, embedder_name):
+        self.chunks = chunks
+        self.vectors = vectors
+        self.schema_version = schema_version
+        self.embedder_name = embedder_name
+
+    @classmethod
+    def build(cls, schema, embedder):
+        chunks = chunk_schema(schema)
+        vectors = embedder.embed([chunk.text for chunk in chunks])
+        return cls(chunks, vectors, schema.version, embedder.name)
+
+    @staticmethod
+    def filename(schema_version, embedder_name):
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", embedder_name)
+        return f"schema_index_{safe_name}_{schema_version}.json"
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        path = os.path.join(index_dir, self.filename(self.schema_version, self.embedder_name))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "schema_version": self.schema_version,
+                "embedder": self.embedder_name,
+                "chunks": [[c.kind, c.table, c.name, c.column] for c in self.chunks],
+                "vectors": [[round(value, 6) for value in vector] for vector in self.vectors],
+            }, f)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, index_dir, schema_version, embedder_name):
+        path = os.path.join(index_dir, cls.filename(schema_version, embedder_name))
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable schema index %s: %s", path, e)
+            return None
+        chunks = [SchemaChunk(kind=kind, table=table, name=name, column=column)
+                  for kind, table, name, column in data["chunks"]]
+        return cls(chunks, data["vectors"], data["schema_version"], data["embedder"])
+
+    def search(self, vector, kind, k):
+        """Return the ``k`` chunks of ``kind`` most similar to ``vector``."""
+        scored = [
+            (_dot(vector, chunk_vector), i)
+            for i, (chunk, chunk_vector) in enumerate(zip(self.chunks, self.vectors))
+            if chunk.kind == kind
+        ]
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [self.chunks[i] for score, i in scored[:k] if score > 0]
+
+
+class SchemaRetriever:
+    """
+    Select the part of a schema relevant to a user requirement.
+
+    Args:
+        embedder: Object with a ``name`` and an ``embed(texts)`` method.
+        index_dir (str, optional): Directory where indexes are persisted.
+        top_k_columns (int, optional): Columns selected per requirement.
+        top_k_keys (int, optional): Dynamic column keys selected per requirement.
+        always_include (tuple, optional): Columns included in every selection.
+    """
+
+    def __init__(
+        self,
+        embedder,
+        index_dir=DEFAULT_INDEX_DIR,
+        top_k_columns=DEFAULT_TOP_K_COLUMNS,
+        top_k_keys=DEFAULT_TOP_K_KEYS,
+        always_include=DEFAULT_ALWAYS_INCLUDE,
+    ):
+        self.embedder = embedder
+        self.fallback = embedder if isinstance(embedder, HashingEmbedder) else HashingEmbedder()
+        self.index_dir = index_dir
+        self.top_k_columns = top_k_columns
+        self.top_k_keys = top_k_keys
+        self.always_include = tuple(always_include)
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _index(self, schema, embedder):
+        key = (schema.version, embedder.name)
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = SchemaIndex.load(self.index_dir, schema.version, embedder.name)
+                if index is None:
+                    index = SchemaIndex.build(schema, embedder)
+                    try:
+                        index.save(self.index_dir)
+                    except OSError as e:
+                        logger.warning("Could not persist schema index: %s", e)
+                self._indexes[key] = index
+        return index
+
+    def _search(self, schema, user_input):
+        try:
+            index = self._index(schema, self.embedder)
+            vector = self.embedder.embed([user_input])[0]
+        except Exception as e:
+            if self.embedder is self.fallback:
+                raise
+            logger.warning("Embedder %s failed, using %s: %s", self.embedder.name, self.fallback.name, e)
+            index = self._index(schema, self.fallback)
+            vector = self.fallback.embed([user_input])[0]
+        return (
+            index.search(vector, "column", self.top_k_columns),
+            index.search(vector, "key", self.top_k_keys),
+        )
+
+    def select(self, schema: Schema, user_input: str) -> Schema:
+        """
+        Return the subset of ``schema`` relevant to ``user_input``.
+
+        Every table keeps the ``always_include`` columns, and a dynamic column
+        is kept whenever one of its keys is selected.
+        """
+        columns = {table.name: {name for name in self.always_include if table.has_column(name)}
+                   for table in schema.tables.values()}
+        keys = {}
+        top_columns, top_keys = self._search(schema, user_input)
+        for chunk in top_columns:
+            columns[chunk.table].add(chunk.name)
+        for chunk in top_keys:
+            columns[chunk.table].add(chunk.column)
+            keys.setdefault((chunk.table, chunk.column), set()).add(chunk.name)
+        return subset_schema(schema, columns, keys)
+
+
+_retrievers = {}
+_retrievers_lock = threading.Lock()
+
+
+def get_retriever(retrieval_config: dict, azure_config: Optional[dict] = None) -> SchemaRetriever:
+    """
+    Get the shared retriever for a retrieval configuration.
+
+    Args:
+        retrieval_config (dict): The ``retrieval`` section of the configuration.
+        azure_config (dict, optional): The ``azure_openai`` section, used when
+            ``retrieval_config['embedder']`` is ``azure_openai``.
+
+    Returns:
+        SchemaRetriever: The retriever.
+    """
+    embedder_kind = retrieval_config.get("embedder") or "hashing"
+    deployment = retrieval_config.get("embedding_deployment")
+    key = (
+        embedder_kind,
+        deployment,
+        retrieval_config.get("index_dir"),
+        retrieval_config.get("top_k_columns"),
+        retrieval_config.get("top_k_keys"),
+    )
+    with _retrievers_lock:
+        retriever = _retrievers.get(key)
+        if retriever is None:
+            if embedder_kind == "azure_openai" and deployment and azure_config:
+                embedder = AzureOpenAIEmbedder(azure_config, deployment)
+            else:
+                embedder = HashingEmbedder()
+            retriever = _retrievers[key] = SchemaRetriever(
+                embedder,
+                index_dir=retrieval_config.get("index_dir") or DEFAULT_INDEX_DIR,
+                top_k_columns=int(retrieval_config.get("top_k_columns") or DEFAULT_TOP_K_COLUMNS),
+                top_k_keys=int(retrieval_config.get("top_k_keys") or DEFAULT_TOP_K_KEYS),
+            )
+    return retriever
@@ -0,0 +1,319 @@
+"""
+HTTP service module for the Kusto Agent.
+
+This module serves query generation and execution over an async ASGI app,
+so one process shares its pooled clients, caches and token provider across
+every concurrent caller instead of each user running a REPL with cold caches.
+
+Generated queries are validated, and caller-written ones only with
+``"validate": true`` since the schema may not cover every table they read.
+Unless the body has ``"guard": false`` queries are then bounded by
+:mod:`query_guard` before they are returned or run.
+
+Endpoints:
+    ``POST /generate``  ``{"requirement"}`` -> the validated KQL.
+    ``POST /execute``   ``{"query"}`` -> the result columns and rows.
+    ``POST /query``     ``{"requirement"}`` -> generate, validate, repair and execute.
+    ``POST /query/stream``  as ``/query``, as server-sent events: ``token`` per
+                        generated fragment, ``repair`` per rejected query, then
+                        ``query``, ``columns``, ``rows`` chunks and ``done`` or ``error``.
+    ``GET /health``     liveness probe.
+    ``GET /metrics``    Prometheus text, see :mod:`metrics`.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from sse_starlette.sse import EventSourceResponse
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from appinsights import AppInsightsQueryError
+from kql_validator import KqlValidationError
+from metrics import registry
+from repair import RepairExhaustedError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 32
+DEFAULT_STREAM_CHUNK_ROWS = 500
+DEFAULT_STREAM_BUFFER = 8
+
+
+class RequestError(Exception):
+    """Raised when a request body is missing a field or is not JSON."""
+
+
+def _attempts(attempts):
+    return [{"query": attempt.query, "error": attempt.error} for attempt in attempts]
+
+
+def error_payload(error):
+    """
+    Map an exception raised while serving a request to a status code and body.
+
+    Returns:
+        tuple: The HTTP status code and the JSON error body.
+    """
+    if isinstance(error, RequestError):
+        return 400, {"error": str(error)}
+    if isinstance(error, KqlValidationError):
+        issues = [str(issue) for issue in error.result.issues]
+        return 422, {"error": str(error), "query": error.result.query, "issues": issues}
+    if isinstance(error, RepairExhaustedError):
+        return 422, {"error": str(error), "attempts": _attempts(error.attempts)}
+    if isinstance(error, AppInsightsQueryError):
+        # Rejected queries are the caller's, authentication and server failures are upstream's
+        status_code = 400 if error.status_code == 400 else 502
+        return status_code, {"error": error.message, "code": error.code, "upstream_status": error.status_code}
+    logger.error("Request failed", exc_info=error)
+    return 500, {"error": f"{type(error).__name__}: {error}"}
+
+
+def error_response(error):
+    """Map an exception raised while serving a request to a JSON error response."""
+    status_code, body = error_payload(error)
+    return JSONResponse(body, status_code=status_code)
+
+
+async def row_chunks(rows, chunk_size=DEFAULT_STREAM_CHUNK_ROWS):
+    """
+    Read rows on a worker thread in lists of ``chunk_size``, one chunk ahead.
+
+    The next chunk is only read once the previous one has been taken, so a
+    slow consumer slows the read of the response body down. If the consumer
+    stops early the rows are closed, which closes the upstream response.
+    """
+    rows = iter(rows)
+    loop = asyncio.get_running_loop()
+
+    def read():
+        return list(islice(rows, chunk_size))
+
+    pending = loop.run_in_executor(None, read)
+    try:
+        while True:
+            # Shielded so that a cancelled consumer does not close the rows while a read is running
+            chunk = await asyncio.shield(pending)
+            if not chunk:
+                return
+            pending = loop.run_in_executor(None, read)
+            yield chunk
+    finally:
+        close = getattr(rows, "close", None)
+        if close is not None:
+            if pending.done():
+                close()
+            else:
+                pending.add_done_callback(lambda _: close())
+
+
+async def _read_field(request, name):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise RequestError("The request body must be a JSON object")
+    if not isinstance(body, dict) or not isinstance(body.get(name), str) or not body[name].strip():
+        raise RequestError(f"The request body must have a non-empty string {name!r}")
+    return body
+
+
+def create_app(context, server_config=None):
+    """
+    Build the ASGI app.
+
+    Args:
+        context (dict): The configuration sections and credentials, as for
+            :func:`batch.run_batch`. ``token`` should be a shared TokenProvider.
+        server_config (dict, optional): The ``server`` section of the
+            configuration: ``concurrency``, the threads running blocking query
+            calls, which is also the least App Insights connections kept
+            alive, ``stream_chunk_rows``, the rows per streamed ``rows`` event,
+            and ``stream_buffer``, the events buffered per streaming client.
+
+    Returns:
+        Starlette: The app, to be served by uvicorn.
+    """
+    from batch import new_result, run_request
+    from query_guard import prepare_query
+    from main import agenerate_kusto_query, astream_kusto_query, forget_generated_query, run_kusto_query, \
+        stream_kusto_table
+    from repair import arun_with_repair
+    from schema_registry import get_schema
+
+    server_config = server_config or {}
+    concurrency = int(server_config.get("concurrency") or DEFAULT_CONCURRENCY)
+    chunk_rows = int(server_config.get("stream_chunk_rows") or DEFAULT_STREAM_CHUNK_ROWS)
+    stream_buffer = int(server_config.get("stream_buffer") or DEFAULT_STREAM_BUFFER)
+    repair_config = context.get("repair_config") or {}
+    # Every thread running a query keeps its connection alive instead of overflowing the pool
+    appinsight_config = context.get("appinsight_config") or {}
+    if int(appinsight_config.get("pool_maxsize") or 0) < concurrency:
+        context = {**context, "appinsight_config": {**appinsight_config, "pool_maxsize": concurrency}}
+
+    def forget(requirement):
+        return lambda attempt: forget_generated_query(requirement, context["azure_config"], context["schema_path"],
+                                                      context["generation_cache_config"])
+
+    def validator(body, validate=True):
+        schema = get_schema(context["schema_path"])
+        validation_config = context.get("validation_config") if validate else None
+        # The caller can explicitly send a query without the added time filter and row limit
+        guard_config = context.get("guard_config") if body.get("guard", True) is not False else None
+        return lambda query: prepare_query(query, schema, validation_config, guard_config).query
+
+    async def generate(request):
+        try:
+            body = await _read_field(request, "requirement")
+            requirement = body["requirement"]
+
+            async def generate_query(feedback):
+                return await agenerate_kusto_query(requirement, context["azure_config"], context["schema_path"],
+                                                   context["retrieval_config"], context["generation_cache_config"],
+                                                   feedback)
+
+            async def accept(query):
+                return None
+
+            # Without execution only validation errors can be repaired
+            outcome = await arun_with_repair(generate_query, accept, validator(body), repair_config.get("max_attempts"),
+                                             repair_config.get("deadline"), forget(requirement))
+        except Exception as e:
+            return error_response(e)
+        return JSONResponse({"query": outcome.query, "attempts": _attempts(outcome.attempts)})
+
+    async def execute(request):
+        try:
+            body = await _read_field(request, "query")
+            # Caller-written queries may read tables the schema does not describe
+            query = validator(body, body.get("validate") is True)(body["query"])
+            response = await asyncio.to_thread(
+                run_kusto_query,
+                query,
+                context["token"],
+                context["app_id"],
+                context["appinsight_config"],
+                context["result_cache_config"],
+                bool(body.get("bypass_cache")),
+            )
+        except Exception as e:
+            return error_response(e)
+        table = response["tables"][0]
+        return JSONResponse({"query": query, "columns": table["columns"], "rows": table["rows"]})
+
+    async def query(request):
+        try:
+            body = await _read_field(request, "requirement")
+            request_id = str(body.get("id") or uuid.uuid4().hex)
+            request_context = context if body.get("guard", True) is not False else {**context, "guard_config": None}
+            result = await run_request(request_id, body["requirement"], request_context,
+                                       new_result(request_id, body["requirement"]))
+        except Exception as e:
+            return error_response(e)
+        return JSONResponse(result)
+
+    async def stream_query(request):
+        try:
+            body = await _read_field(request, "requirement")
+        except RequestError as e:
+            return error_response(e)
+        requirement = body["requirement"]
+        # Bounded, so a slow client pauses generation and the read of the result
+        events = asyncio.Queue(maxsize=stream_buffer)
+
+        async def produce():
+            started = asyncio.get_running_loop().time()
+            try:
+                async def generate_query(feedback):
+                    if feedback:
+                        await events.put(("repair", {"query": feedback[-1].query, "error": feedback[-1].error}))
+                    generation = await astream_kusto_query(requirement, context["azure_config"],
+                                                           context["schema_path"], context["retrieval_config"],
+                                                           context["generation_cache_config"], feedback)
+                    async for delta in generation:
+                        await events.put(("token", {"text": delta}))
+                    return generation.query
+
+                async def execute(query):
+                    table = await asyncio.to_thread(stream_kusto_table, query, context["token"], context["app_id"],
+                                                    context["appinsight_config"], context["result_cache_config"])
+                    await events.put(("query", {"query": query}))
+                    await events.put(("columns", {"columns": table.columns}))
+                    count = 0
+                    async for chunk in row_chunks(table.rows, chunk_rows):
+                        count += len(chunk)
+                        await events.put(("rows", {"rows": chunk}))
+                    return count
+
+                outcome = await arun_with_repair(generate_query, execute, validator(body),
+                                                 repair_config.get("max_attempts"), repair_config.get("deadline"),
+                                                 forget(requirement))
+                elapsed = asyncio.get_running_loop().time() - started
+                await events.put(("done", {"rows": outcome.result, "attempts": len(outcome.attempts),
+                                           "elapsed": round(elapsed, 4)}))
+            except Exception as e:
+                status_code, error = error_payload(e)
+                await events.put(("error", {**error, "status": status_code}))
+            finally:
+                await events.put(None)
+
+        async def event_stream():
+            producer = asyncio.create_task(produce())
+            try:
+                while True:
+                    item = await events.get()
+                    if item is None:
+                        return
+                    name, data = item
+                    yield {"event": name, "data": json.dumps(data, ensure_ascii=False, default=str)}
+            finally:
+                # The client went away or the stream ended, stop generating and reading rows
+                producer.cancel()
+
+        return EventSourceResponse(event_stream(), ping=15)
+
+    async def health(request):
+        return JSONResponse({"status": "ok"})
+
+    async def metrics(request):
+        return PlainTextResponse(registry.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        from appinsights import close_appinsights_clients
+        from llm_client import aclose_clients
+
+        # Blocking App Insights calls run on a pool sized for the expected concurrency
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="kusto-server")
+        )
+        try:
+            yield
+        finally:
+            await aclose_clients()
+            close_appinsights_clients()
+
+    return Starlette(
+        routes=[
+            Route("/generate", generate, methods=["POST"]),
+            Route("/execute", execute, methods=["POST"]),
+            Route("/query", query, methods=["POST"]),
+            Route("/query/stream", stream_query, methods=["POST"]),
+            Route("/health", health, methods=["GET"]),
+            Route("/metrics", metrics, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+def serve(context, host="localhost", port=5001, server_config=None):
+    """Serve the app with uvicorn until interrupted, see :func:`create_app`."""
+    import uvicorn
+
+    uvicorn.run(create_app(context, server_config), host=host, port=port, log_level="info")
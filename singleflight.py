@@ -0,0 +1,103 @@
+"""
+Request coalescing module for the Kusto Agent.
+
+This module deduplicates identical calls that are in flight at the same
+time: the first caller for a key does the work and every concurrent caller
+with the same key waits for and receives its result, or its exception,
+instead of repeating the LLM call or the App Insights query.
+"""
+
+import asyncio
+import logging
+import threading
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls across threads.
+
+    Args:
+        name (str): Label of the coalesced calls in the metrics.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call ``fn(*args, **kwargs)`` unless a call for ``key`` is already running.
+
+        Returns:
+            The result of the call, shared with every concurrent caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        if not leader:
+            registry.increment("coalesced", self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """
+    Coalesce concurrent coroutine calls on the same event loop.
+
+    The call runs as its own task, so a caller that is cancelled does not
+    cancel it for the others.
+
+    Args:
+        name (str): Label of the coalesced calls in the metrics.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._tasks = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        """
+        Await ``fn(*args, **kwargs)`` unless a call for ``key`` is already running.
+
+        Returns:
+            The result of the call, shared with every concurrent caller.
+        """
+        # Tasks belong to one loop, batch runs and the service each have their own
+        key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            registry.increment("coalesced", self.name)
+        return await asyncio.shield(task)
@@ -0,0 +1,220 @@
+"""
+Local stand-ins for the Kusto Agent's remote services.
+
+This module serves fake Azure OpenAI chat completions and Application
+Insights ``/v1/apps/{id}/query`` endpoints on localhost, with configurable
+latency, payload size and error rates, so the pipeline can be exercised and
+benchmarked without network access or credentials.
+"""
+
+import gzip
+import json
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY = "customEvents | where timestamp > ago(1h) | summarize count() by name | take 100"
+_QUERY_PATH = re.compile(r"^/v1/apps/[^/]+/query$")
+
+
+@dataclass
+class StubOptions:
+    """
+    Behaviour of a stub server.
+
+    Attributes:
+        latency (float): Seconds before the response starts.
+        jitter (float): Up to this many seconds are added to ``latency`` at random.
+        error_rate (float): Fraction of requests answered with an error.
+        token_latency (float): Seconds between streamed completion chunks.
+        query (str): The KQL returned by the chat completions stub.
+        rows (int): Rows returned by the query stub.
+        row_bytes (int): Approximate size of each returned row.
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    token_latency: float = 0.0
+    query: str = DEFAULT_QUERY
+    rows: int = 100
+    row_bytes: int = 200
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, with Nagle a kept-alive connection waits for the delayed ACK
+    disable_nagle_algorithm = True
+
+    @property
+    def options(self):
+        return self.server.options
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _wait(self):
+        delay = self.options.latency + random.uniform(0, self.options.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _failed(self):
+        return self.options.error_rate and random.random() < self.options.error_rate
+
+    def _send(self, status, body, content_type="application/json"):
+        headers = {"Content-Type": content_type}
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        logger.debug("Stub request: " + format, *args)
+
+
+class _ChatCompletionsHandler(_StubHandler):
+    def do_POST(self):
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            self._send(404, b'{"error": {"code": "NotFound", "message": "Unknown path"}}')
+            return
+        request = self._read_json()
+        self.server.count()
+        self._wait()
+        if self._failed():
+            self._send(500, b'{"error": {"code": "InternalServerError", "message": "Stub failure"}}')
+            return
+
+        query = self.options.query
+        prompt_tokens = sum(len(message.get("content") or "") for message in request.get("messages", ())) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(query) // 4,
+            "total_tokens": prompt_tokens + len(query) // 4,
+            "prompt_tokens_details": {"cached_tokens": prompt_tokens // 1024 * 1024},
+        }
+        common = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get("model", "stub")}
+        if not request.get("stream"):
+            body = {
+                **common,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": query}}],
+                "usage": usage,
+            }
+            self._send(200, json.dumps(body).encode("utf-8"))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(query), 4):
+            if start and self.options.token_latency:
+                time.sleep(self.options.token_latency)
+            chunk = {**common, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "finish_reason": None, "delta": {"content": query[start:start + 4]}}]}
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            chunk = {**common, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+
+class _QueryHandler(_StubHandler):
+    def do_POST(self):
+        if not _QUERY_PATH.match(self.path.split("?")[0]):
+            self._send(404, b'{"error": {"code": "PathNotFoundError", "message": "Unknown path"}}')
+            return
+        request = self._read_json()
+        self.server.count()
+        self._wait()
+        if self._failed():
+            error = {"error": {"code": "BadArgumentError", "message": "The request had some invalid properties",
+                               "innererror": {"code": "SemanticError",
+                                              "message": f"Stub failure for query: {request.get('query')}"}}}
+            self._send(400, json.dumps(error).encode("utf-8"))
+            return
+        self._send(200, self.server.result_body())
+
+
+def _result_body(options):
+    padding = "x" * max(options.row_bytes - 120, 0)
+    rows = [
+        ["2024-01-01T00:00:00.0000000Z", f"Event{i % 10}", json.dumps({"JobId": str(i), "Padding": padding}), i]
+        for i in range(options.rows)
+    ]
+    return json.dumps({"tables": [{
+        "name": "PrimaryResult",
+        "columns": [{"name": "timestamp", "type": "datetime"}, {"name": "name", "type": "string"},
+                    {"name": "customDimensions", "type": "dynamic"}, {"name": "itemCount", "type": "int"}],
+        "rows": rows,
+    }]}).encode("utf-8")
+
+
+class StubServer:
+    """
+    A stub service running on a background thread.
+
+    Args:
+        kind (str): ``openai`` for chat completions or ``appinsights`` for queries.
+        options (StubOptions, optional): How the stub responds.
+        host (str, optional): Interface to listen on.
+        port (int, optional): Port to listen on, any free port by default.
+    """
+
+    def __init__(self, kind, options=None, host="127.0.0.1", port=0):
+        handler = {"openai": _ChatCompletionsHandler, "appinsights": _QueryHandler}[kind]
+        self.kind = kind
+        self.options = options or StubOptions()
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._body = None
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._server.options = self.options
+        self._server.count = self._count
+        self._server.result_body = self._result_body
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"stub-{kind}", daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self):
+        with self._lock:
+            self.requests += 1
+
+    def _result_body(self):
+        # Rendered once, the stub should not be the bottleneck
+        if self._body is None:
+            self._body = _result_body(self.options)
+        return self._body
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,23 @@
+from cache import generation_cache_key, normalize_requirement
+
+
+def test_case_whitespace_and_sentence_punctuation_are_ignored():
+    assert normalize_requirement("Count  events, by name?") == normalize_requirement("count events by name")
+
+
+def test_comparison_operators_are_kept():
+    assert normalize_requirement("events with duration > 5s") != normalize_requirement("events with duration < 5s")
+    assert normalize_requirement("name != Login") != normalize_requirement("name == Login")
+
+
+def test_dashes_and_decimal_points_are_kept():
+    assert normalize_requirement("duration over 2.5s") == "duration over 2.5s"
+    assert normalize_requirement("the sign-in events") != normalize_requirement("the sign in events")
+
+
+def test_quoted_literals_are_kept_verbatim():
+    assert normalize_requirement('events named "Job, Done."') == 'events named "Job, Done."'
+
+
+def test_requirements_differing_by_an_operator_have_different_keys():
+    assert generation_cache_key("duration > 5s", "v1", "gpt") != generation_cache_key("duration < 5s", "v1", "gpt")
@@ -0,0 +1,66 @@
+import csv
+import json
+
+import pytest
+
+from export import export_rows, output_path_for
+
+COLUMNS = [
+    {"name": "timestamp", "type": "datetime"},
+    {"name": "name", "type": "string"},
+    {"name": "customDimensions", "type": "dynamic"},
+    {"name": "customDimensions_JobUrl", "type": "dynamic"},
+    {"name": "n", "type": "long"},
+]
+ROWS = [
+    ["2024-01-01T00:00:00Z", "Start", '{"JobId":"1","Tags":["a","b"]}', "https://example/job/1", 3],
+    ["2024-01-01T00:00:01Z", "Stop", '["x",1]', "[not json", 4],
+    ["2024-01-01T00:00:02Z", None, None, "", None],
+]
+
+
+def test_ndjson_embeds_dynamic_containers_and_quotes_scalars(tmp_path):
+    path = tmp_path / "out.ndjson"
+    stats = export_rows(COLUMNS, iter(ROWS), str(path), chunk_size=2)
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert stats.rows == 3
+    assert records[0]["customDimensions"] == {"JobId": "1", "Tags": ["a", "b"]}
+    assert records[0]["customDimensions_JobUrl"] == "https://example/job/1"
+    assert records[1]["customDimensions"] == ["x", 1]
+    assert records[1]["customDimensions_JobUrl"] == "[not json"
+    assert records[2] == {"timestamp": "2024-01-01T00:00:02Z", "name": None, "customDimensions": None,
+                          "customDimensions_JobUrl": "", "n": None}
+
+
+def test_csv_writes_a_header_and_every_row(tmp_path):
+    path = tmp_path / "out.csv"
+    export_rows(COLUMNS, ROWS, str(path), chunk_size=2)
+    with open(path, newline="", encoding="utf-8") as f:
+        lines = list(csv.reader(f))
+    assert lines[0] == [column["name"] for column in COLUMNS]
+    assert lines[1][2] == '{"JobId":"1","Tags":["a","b"]}'
+    assert lines[1][3] == "https://example/job/1"
+    assert len(lines) == 4
+
+
+def test_parquet_keeps_scalar_dynamic_cells(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "out.parquet"
+    stats = export_rows(COLUMNS, ROWS, str(path), chunk_size=2)
+    table = pq.read_table(str(path))
+    assert stats.rows == table.num_rows == 3
+    assert table.column("customDimensions_JobUrl").to_pylist()[0] == "https://example/job/1"
+    assert table.column("n").to_pylist() == [3, 4, None]
+
+
+def test_empty_results_and_unknown_formats(tmp_path):
+    path = tmp_path / "empty.ndjson"
+    assert export_rows(COLUMNS, [], str(path)).rows == 0
+    assert path.read_text() == ""
+    with pytest.raises(ValueError):
+        export_rows(COLUMNS, ROWS, str(tmp_path / "out.xlsx"))
+
+
+def test_output_path_for():
+    assert output_path_for("out/{id}.csv", 7) == "out/7.csv"
+    assert output_path_for("out/results.csv", 7) == "out/results.7.csv"
@@ -0,0 +1,52 @@
+import pytest
+
+from kql_validator import KqlValidationError, check_query, validate_query
+from schema_registry import get_schema
+
+
+@pytest.fixture(scope="module")
+def schema():
+    return get_schema()
+
+
+@pytest.mark.parametrize("query", [
+    "customEvents | where timestamp > ago(1h) | summarize count() by name",
+    "customEvents | extend JobId = tostring(customDimensions.JobID) | project JobId",
+    'customEvents | where customDimensions["JobID"] != "" | take 10',
+    "customEvents | summarize count() by name | order by count_ desc",
+    "let recent = customEvents | where timestamp > ago(1d); recent | project name",
+    'customEvents | parse name with "job-" jobName | project jobName',
+    'customEvents | parse name with * "-" jobKind:string "-" jobNumber:long | project jobKind, jobNumber',
+    "customEvents | count | where Count > 0",
+    "customEvents | where timestamp > ago(1h) | evaluate bag_unpack(customDimensions) | project JobID",
+    "customEvents | project name | evaluate bag_unpack(name) | project Anything; customEvents | take 1",
+    "```kql\ncustomEvents | take 5\n```",
+    "customEvents | project customDimensions.JobUrl | where isnotempty(customDimensions_JobUrl)",
+    "customEvents | summarize count() by tostring(customDimensions.JobID) | order by customDimensions_JobID asc",
+    'customEvents | summarize dcount(name) by tostring(customDimensions["JobID"]) | project customDimensions_JobID',
+])
+def test_valid_queries_are_accepted(schema, query):
+    result = validate_query(query, schema)
+    assert result.valid, str(result)
+
+
+@pytest.mark.parametrize("query, message", [
+    ("customEvent | take 10", "Unknown table 'customEvent'"),
+    ("customEvents | project Name", "Unknown column 'Name'"),
+    ("customEvents | where customDimensions.JobId == '1'", "Unknown customDimensions key 'JobId'"),
+    ('customEvents | parse name with "job-" jobName | project jobNam', "Unknown column 'jobNam'"),
+    ("customEvents | where Count > 0", "Unknown column 'Count'"),
+    ("customEvents | project customDimensions_NoSuchKey", "Unknown column 'customDimensions_NoSuchKey'"),
+    ("customEvents | project nme | evaluate bag_unpack(customDimensions)", "Unknown column 'nme'"),
+    ("", "The query is empty"),
+])
+def test_invalid_queries_are_rejected(schema, query, message):
+    result = validate_query(query, schema)
+    assert message in [issue.message for issue in result.issues]
+
+
+def test_check_query_strips_fences_and_raises(schema):
+    assert check_query("```\ncustomEvents | take 1\n```", schema) == "customEvents | take 1"
+    with pytest.raises(KqlValidationError) as error:
+        check_query("customEvents | project Name", schema)
+    assert error.value.result.issues[0].suggestion == "name"
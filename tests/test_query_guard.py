@@ -0,0 +1,93 @@
+import pytest
+
+from kql_validator import KqlValidationError
+from query_guard import guard_query, prepare_query
+from schema_registry import get_schema
+
+GUARD = {"enabled": True, "time_column": "timestamp", "time_range": "24h", "row_limit": 10000}
+
+
+@pytest.fixture(scope="module")
+def schema():
+    return get_schema()
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("customEvents", "customEvents | where timestamp > ago(24h) | take 10000"),
+    ("customEvents | summarize count() by name",
+     "customEvents | where timestamp > ago(24h) | summarize count() by name | take 10000"),
+    ("customEvents | where timestamp > ago(1h) | take 5", "customEvents | where timestamp > ago(1h) | take 5"),
+    ("customEvents | where name == 'x' | count", "customEvents | where timestamp > ago(24h) | where name == 'x' | count"),
+    ("customEvents | where timestamp > ago(1h) | summarize count()", "customEvents | where timestamp > ago(1h) | summarize count()"),
+    ("customEvents | where (timestamp between (datetime(2024-01-01) .. datetime(2024-01-02)))",
+     "customEvents | where (timestamp between (datetime(2024-01-01) .. datetime(2024-01-02))) | take 10000"),
+])
+def test_missing_bounds_are_added(schema, query, expected):
+    assert guard_query(query, GUARD, schema).query == expected
+
+
+def test_take_goes_before_render(schema):
+    result = guard_query("customEvents | summarize count() by bin(timestamp, 1h) | render timechart", GUARD, schema)
+    assert result.query == ("customEvents | where timestamp > ago(24h) | summarize count() by bin(timestamp, 1h) "
+                            "| take 10000 | render timechart")
+    assert result.added == ["where timestamp > ago(24h)", "take 10000"]
+
+
+def test_let_bound_source_is_left_alone(schema):
+    query = "let recent = customEvents | where timestamp > ago(2d); recent | count"
+    assert guard_query(query, GUARD, schema).query == query
+
+
+def test_let_source_without_limit_gets_only_a_take(schema):
+    query = "let recent = customEvents | where timestamp > ago(2d); recent | project name"
+    assert guard_query(query, GUARD, schema).query == query + " | take 10000"
+
+
+def test_trailing_semicolon_and_comments_are_kept(schema):
+    assert guard_query("customEvents | project name;", GUARD, schema).query == \
+        "customEvents | where timestamp > ago(24h) | project name | take 10000;"
+    query = "customEvents // all events\n| where name == 'x' // only x"
+    assert guard_query(query, GUARD, schema).query == \
+        "customEvents | where timestamp > ago(24h) // all events\n| where name == 'x' | take 10000 // only x"
+
+
+def test_code_fences_are_stripped(schema):
+    assert guard_query("```kql\ncustomEvents | take 5\n```", GUARD, schema).query == \
+        "customEvents | where timestamp > ago(24h) | take 5"
+
+
+def test_tables_without_the_time_column_get_no_time_filter(schema):
+    assert guard_query("Unknown | project a", GUARD, schema).query == "Unknown | project a | take 10000"
+    assert guard_query("union customEvents, customEvents | take 3", GUARD, schema).added == []
+
+
+@pytest.mark.parametrize("query", [
+    "customEvents",
+    "customEvents | summarize count() by name | render barchart",
+    "let recent = customEvents; recent | project name;",
+    "customEvents // note\n| project name // end",
+    "customEvents | join (customEvents | where timestamp > ago(1h)) on name",
+])
+def test_guarding_is_idempotent(schema, query):
+    once = guard_query(query, GUARD, schema)
+    twice = guard_query(once.query, GUARD, schema)
+    assert twice.query == once.query
+    assert not twice.changed
+
+
+def test_configuration_skips_bounds(schema):
+    assert guard_query("customEvents", None, schema).query == "customEvents"
+    assert guard_query("customEvents", {**GUARD, "enabled": False}, schema).query == "customEvents"
+    assert guard_query("customEvents", {**GUARD, "time_range": None, "row_limit": 50}, schema).query == \
+        "customEvents | take 50"
+    assert guard_query("customEvents", {**GUARD, "time_range": "7d", "row_limit": None}, schema).query == \
+        "customEvents | where timestamp > ago(7d)"
+
+
+def test_prepare_query_validates_then_guards(schema):
+    assert prepare_query("customEvents", schema, {"enabled": True}, GUARD).query == \
+        "customEvents | where timestamp > ago(24h) | take 10000"
+    with pytest.raises(KqlValidationError):
+        prepare_query("customEvents | project Name", schema, {"enabled": True}, GUARD)
+    assert prepare_query("customEvents | project Name", schema, {"enabled": False}, None).query == \
+        "customEvents | project Name"
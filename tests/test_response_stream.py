@@ -0,0 +1,99 @@
+import json
+import random
+
+import pytest
+
+from response_stream import stream_tables
+
+BODY = {
+    "tables": [
+        {
+            "name": "PrimaryResult",
+            "columns": [{"name": "name", "type": "string"}, {"name": "value", "type": "real"},
+                        {"name": "customDimensions", "type": "dynamic"}],
+            "rows": [
+                ["Zürich ✓ 日本", 12345.678e-3, '{"Tag":"ü"}'],
+                ["😀 emoji", -9876543210, None],
+                ["plain", 0.5, "[1,2]"],
+            ],
+        },
+        {"name": "Second", "columns": [{"name": "n", "type": "long"}], "rows": [[1], [22], [333]]},
+    ],
+    "statistics": {"query": {"executionTime": 0.1}},
+}
+
+
+def _split(data, sizes):
+    chunks, start = [], 0
+    for size in sizes:
+        chunks.append(data[start:start + size])
+        start += size
+    chunks.append(data[start:])
+    return chunks
+
+
+def _read(chunks):
+    return [(table.name, table.columns, list(table.rows)) for table in stream_tables(chunks)]
+
+
+def _expected(body):
+    return [(table.get("name"), table.get("columns"), table["rows"]) for table in body["tables"]]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_arbitrary_chunk_boundaries(seed):
+    data = json.dumps(BODY, ensure_ascii=False, indent=seed % 3 or None).encode("utf-8")
+    generator = random.Random(seed)
+    sizes = [generator.randint(1, 7) for _ in range(len(data))]
+    assert _read(_split(data, sizes)) == _expected(BODY)
+
+
+def test_one_byte_chunks_split_multibyte_characters_and_numbers():
+    data = json.dumps(BODY, ensure_ascii=False).encode("utf-8")
+    assert _read([data[i:i + 1] for i in range(len(data))]) == _expected(BODY)
+
+
+def test_text_chunks_are_accepted():
+    text = json.dumps(BODY)
+    assert _read([text[:10], text[10:]]) == _expected(BODY)
+
+
+def test_rows_before_columns():
+    body = {"tables": [{"rows": [[1, "a"]], "name": "PrimaryResult", "columns": [{"name": "n", "type": "long"}]}]}
+    tables = stream_tables([json.dumps(body).encode("utf-8")])
+    table = next(tables)
+    # The columns come after the rows, so they are not known while the rows are read
+    assert table.columns is None
+    assert list(table.rows) == [[1, "a"]]
+    assert next(tables, None) is None
+
+
+def test_unconsumed_table_is_skipped():
+    data = json.dumps(BODY).encode("utf-8")
+    tables = stream_tables([data[i:i + 5] for i in range(0, len(data), 5)])
+    first = next(tables)
+    assert first.name == "PrimaryResult"
+    second = next(tables)
+    assert second.name == "Second"
+    assert list(second.rows) == [[1], [22], [333]]
+
+
+@pytest.mark.parametrize("cut", [1, 15, 60, -40, -3])
+def test_truncated_body_raises_a_parse_error(cut):
+    data = json.dumps(BODY, ensure_ascii=False).encode("utf-8")
+    with pytest.raises(ValueError) as error:
+        _read([data[:cut]])
+    assert not isinstance(error.value, UnicodeDecodeError)
+
+
+def test_truncated_inside_a_multibyte_character():
+    data = json.dumps(BODY, ensure_ascii=False).encode("utf-8")
+    cut = data.index("日".encode("utf-8")) + 1
+    with pytest.raises(ValueError, match="UTF-8") as error:
+        _read([data[:cut]])
+    assert not isinstance(error.value, UnicodeDecodeError)
+
+
+def test_truncated_inside_a_string():
+    with pytest.raises(ValueError, match="truncated"):
+        _read([b'{"tables": [{"rows": [["unterminated'])
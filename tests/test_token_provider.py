@@ -0,0 +1,45 @@
+import time
+
+from token_provider import TokenProvider, resolve_token
+
+
+class FakeCredential:
+    def __init__(self):
+        self.calls = 0
+
+    def get_token(self, scope):
+        self.calls += 1
+
+        class AccessToken:
+            token = f"fresh-{self.calls}"
+            expires_on = int(time.time()) + 3600
+
+        return AccessToken()
+
+
+def test_seeded_token_is_used_without_login():
+    credential = FakeCredential()
+    provider = TokenProvider(credential)
+    provider.seed("parent", time.time() + 3600)
+    assert provider.get_token() == "parent"
+    assert credential.calls == 0
+
+
+def test_expiring_seed_is_refreshed():
+    credential = FakeCredential()
+    provider = TokenProvider(credential, refresh_margin=300)
+    provider.seed("parent", time.time() + 60)
+    assert provider.get_token() == "fresh-1"
+
+
+def test_older_seed_does_not_replace_a_newer_token():
+    provider = TokenProvider(FakeCredential())
+    provider.get_token()
+    provider.seed("stale", time.time() + 10)
+    assert provider.get_token() == "fresh-1"
+
+
+def test_resolve_token_accepts_strings_and_providers():
+    provider = TokenProvider(FakeCredential())
+    assert resolve_token("bearer") == "bearer"
+    assert resolve_token(provider) == "fresh-1"
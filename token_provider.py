@@ -0,0 +1,217 @@
+"""
+Access token module for the Kusto Agent.
+
+This module caches the Application Insights access token together with its
+expiry, refreshes it in the background before it expires, optionally keeps
+it in a local file so restarts do not need another login, and builds
+non-interactive credentials for batch and server modes.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCOPE = "https://api.applicationinsights.io/.default"
+DEFAULT_REFRESH_MARGIN = 300
+RETRY_INTERVAL = 30
+
+
+def build_credential(auth_config):
+    """
+    Build the azure.identity credential selected by ``auth_config['method']``.
+
+    Supported methods are ``interactive`` (browser login), ``default``
+    (DefaultAzureCredential), ``client_secret``, ``managed_identity``,
+    ``azure_cli`` and ``device_code``.
+
+    Args:
+        auth_config (dict): The ``auth`` section of the configuration.
+
+    Returns:
+        TokenCredential: The credential.
+    """
+    import azure.identity as identity
+
+    method = auth_config.get("method") or "interactive"
+    tenant_id = auth_config.get("tenant_id")
+    client_id = auth_config.get("client_id")
+    if method == "interactive":
+        kwargs = {"tenant_id": tenant_id} if tenant_id else {}
+        return identity.InteractiveBrowserCredential(**kwargs)
+    if method == "default":
+        return identity.DefaultAzureCredential(exclude_interactive_browser_credential=True)
+    if method == "client_secret":
+        return identity.ClientSecretCredential(tenant_id, client_id, auth_config.get("client_secret"))
+    if method == "managed_identity":
+        return identity.ManagedIdentityCredential(client_id=client_id)
+    if method == "azure_cli":
+        return identity.AzureCliCredential(tenant_id=tenant_id)
+    if method == "device_code":
+        kwargs = {"tenant_id": tenant_id} if tenant_id else {}
+        return identity.DeviceCodeCredential(**kwargs)
+    raise ValueError(f"Unknown auth method: {method}")
+
+
+class TokenProvider:
+    """
+    Cached access token for one scope, refreshed ahead of its expiry.
+
+    Args:
+        credential: An azure.identity credential, or a callable returning one
+            so that it is only built when a token is first needed.
+        scope (str, optional): The scope the token is requested for.
+        refresh_margin (float, optional): Seconds before expiry at which the
+            token is refreshed.
+        cache_path (str, optional): File the token is persisted to and loaded
+            from, so a restart within the token lifetime needs no login.
+    """
+
+    def __init__(self, credential, scope=DEFAULT_SCOPE, refresh_margin=DEFAULT_REFRESH_MARGIN, cache_path=None):
+        self._credential = credential
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self.cache_path = cache_path
+        self._token = None
+        self._expires_on = 0
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stopped = threading.Event()
+        self._load()
+
+    @property
+    def credential(self):
+        if callable(self._credential) and not hasattr(self._credential, "get_token"):
+            self._credential = self._credential()
+        return self._credential
+
+    @property
+    def expires_on(self):
+        return self._expires_on
+
+    def _fresh(self):
+        return self._token is not None and self._expires_on - self.refresh_margin > time.time()
+
+    def get_token(self):
+        """Return a token valid for at least ``refresh_margin`` seconds."""
+        if self._fresh():
+            return self._token
+        with self._lock:
+            if not self._fresh():
+                self._refresh()
+        return self._token
+
+    def seed(self, token, expires_on):
+        """Use a token obtained elsewhere, e.g. by a parent process, until it is due for refresh."""
+        with self._lock:
+            if expires_on > self._expires_on:
+                self._token = token
+                self._expires_on = expires_on
+
+    def invalidate(self):
+        """Forget the cached token, e.g. after the API rejected it."""
+        with self._lock:
+            self._token = None
+            self._expires_on = 0
+
+    def _refresh(self):
+        started = time.perf_counter()
+        access_token = self.credential.get_token(self.scope)
+        self._token = access_token.token
+        self._expires_on = access_token.expires_on
+        logger.info("Refreshed access token in %.2fs, expires in %ds",
+                    time.perf_counter() - started, self._expires_on - time.time())
+        self._save()
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable token cache %s: %s", self.cache_path, e)
+            return
+        if cached.get("scope") == self.scope:
+            self._token = cached.get("token")
+            self._expires_on = cached.get("expires_on", 0)
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.cache_path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.cache_path}.tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"scope": self.scope, "token": self._token, "expires_on": self._expires_on}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("Could not persist access token to %s: %s", self.cache_path, e)
+
+    def start_background_refresh(self):
+        """Refresh the token from a daemon thread shortly before it expires."""
+        if self._refresher is not None:
+            return
+        self._stopped.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop_background_refresh(self):
+        self._stopped.set()
+        self._refresher = None
+
+    def _refresh_loop(self):
+        while not self._stopped.is_set():
+            wait = self._expires_on - self.refresh_margin - time.time()
+            if wait > 0:
+                self._stopped.wait(wait)
+                continue
+            try:
+                with self._lock:
+                    if not self._fresh():
+                        self._refresh()
+            except Exception as e:
+                logger.warning("Background token refresh failed, retrying in %ds: %s", RETRY_INTERVAL, e)
+                self._stopped.wait(RETRY_INTERVAL)
+
+
+def resolve_token(token):
+    """Return the bearer token of a TokenProvider, or ``token`` itself if it is a string."""
+    return token if isinstance(token, str) else token.get_token()
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(auth_config):
+    """
+    Get the shared token provider of this process for an auth configuration.
+
+    Args:
+        auth_config (dict): The ``auth`` section of the configuration.
+
+    Returns:
+        TokenProvider: The provider, with background refresh started when
+        ``auth_config['background_refresh']`` is set.
+    """
+    scope = auth_config.get("scope") or DEFAULT_SCOPE
+    key = (auth_config.get("method"), auth_config.get("tenant_id"), auth_config.get("client_id"),
+           scope, auth_config.get("cache_path"))
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = _providers[key] = TokenProvider(
+                lambda: build_credential(auth_config),
+                scope=scope,
+                refresh_margin=float(auth_config.get("refresh_margin") or DEFAULT_REFRESH_MARGIN),
+                cache_path=auth_config.get("cache_path"),
+            )
+            if auth_config.get("background_refresh"):
+                provider.start_background_refresh()
+    return provider
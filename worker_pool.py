@@ -0,0 +1,241 @@
+"""
+Worker pool module for the Kusto Agent.
+
+This module shards a batch of requirements across a pool of processes. Work
+items live in a SQLite queue so that an interrupted job can be resumed
+without redoing the items that already finished.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+from batch import DEFAULT_CONCURRENCY, process_request, read_requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class WorkQueue:
+    """
+    Work queue of batch requests persisted in a SQLite database.
+
+    Items move from ``pending`` to ``running`` when a worker claims them and
+    to ``done`` or ``failed`` when their result is recorded. Every process
+    opens its own queue on the same file, and within a process the queue
+    may be used from several threads.
+
+    Args:
+        path (str): Path to the database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "id TEXT NOT NULL UNIQUE, "
+            "requirement TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "worker INTEGER, "
+            "result TEXT, "
+            "finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status, seq)")
+
+    def enqueue(self, requests):
+        """Add ``(request_id, requirement)`` pairs, ignoring ids already queued."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO items (id, requirement) VALUES (?, ?)", requests
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def requeue(self, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Make interrupted items, and failed items with attempts left, pending again.
+
+        Returns:
+            int: The number of requeued items.
+        """
+        cursor = self._conn.execute(
+            "UPDATE items SET status = 'pending', worker = NULL "
+            "WHERE status = 'running' OR (status = 'failed' AND attempts < ?)",
+            (max_attempts,),
+        )
+        return cursor.rowcount
+
+    def claim(self, worker_id):
+        """
+        Claim the oldest pending item.
+
+        Returns:
+            tuple: ``(request_id, requirement)``, or None when nothing is pending.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, requirement FROM items WHERE status = 'pending' ORDER BY seq LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE items SET status = 'running', worker = ?, attempts = attempts + 1 WHERE id = ?",
+                        (worker_id, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def complete(self, result):
+        """Record the result of a claimed item."""
+        payload = json.dumps(result, ensure_ascii=False, default=str)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE items SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+                ("failed" if result.get("error") else "done", payload, time.time(), result["id"]),
+            )
+
+    def counts(self):
+        return dict(self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+
+    def results(self):
+        """Yield the recorded results in completion order."""
+        for (result,) in self._conn.execute(
+            "SELECT result FROM items WHERE result IS NOT NULL ORDER BY finished_at, seq"
+        ):
+            yield result
+
+    def close(self):
+        self._conn.close()
+
+
+async def _worker_loop(queue, worker_id, context, concurrency):
+    from llm_client import aclose_clients
+
+    async def lane():
+        while True:
+            # Waiting on another worker's lock must not stall the other lanes of this loop
+            item = await asyncio.to_thread(queue.claim, worker_id)
+            if item is None:
+                return
+            result = await process_request(item[0], item[1], context)
+            result["worker"] = worker_id
+            await asyncio.to_thread(queue.complete, result)
+
+    try:
+        await asyncio.gather(*(lane() for _ in range(concurrency)))
+    finally:
+        await aclose_clients()
+
+
+def _worker_main(queue_path, worker_id, context, concurrency):
+    logging.basicConfig(level=logging.INFO)
+    seed = context.pop("token_seed", None)
+    if seed is not None:
+        from token_provider import get_token_provider
+
+        # The parent's token, so the worker only logs in itself once it expires
+        context["token"] = get_token_provider(context["auth_config"])
+        context["token"].seed(*seed)
+    queue = WorkQueue(queue_path)
+    try:
+        asyncio.run(_worker_loop(queue, worker_id, context, concurrency))
+    finally:
+        queue.close()
+
+
+def run_worker_pool(input_path, output_path, context, workers, concurrency=DEFAULT_CONCURRENCY,
+                    queue_path=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Process a JSONL file of requirements with a pool of worker processes.
+
+    Each worker runs its own event loop with ``concurrency`` requests in
+    flight and its own pooled OpenAI and App Insights clients and token
+    provider, built from ``context['auth_config']`` and starting from the
+    parent's current token. Set ``cache_path`` in the auth configuration to
+    let workers also share the tokens refreshed later instead of each logging
+    in once the first one expires. A plain bearer token string is passed to
+    the workers as is. Progress is
+    kept in ``queue_path``; running the same job again resumes it, retrying
+    interrupted items and failed items with attempts left. When every worker
+    has exited, all recorded results are written to ``output_path`` in
+    completion order.
+
+    Args:
+        input_path (str): JSONL file of requirements, see :func:`batch.read_requests`.
+        output_path (str): JSONL file the results are written to.
+        context (dict): See :func:`batch.run_batch`.
+        workers (int): Number of worker processes.
+        concurrency (int, optional): Requests in flight per worker.
+        queue_path (str, optional): Queue database, defaults to
+            ``<output_path>.queue.sqlite``.
+        max_attempts (int, optional): Attempts per item across resumes.
+
+    Returns:
+        dict: Counts of ``succeeded``, ``failed`` and ``unfinished`` requests
+        and the ``elapsed`` wall time in seconds.
+    """
+    queue_path = queue_path or f"{output_path}.queue.sqlite"
+    started = time.perf_counter()
+    token = context.get("token")
+    if token is not None and not isinstance(token, str):
+        # Token providers hold locks and credentials, each worker builds its own from the parent's token
+        if not context["auth_config"].get("cache_path"):
+            logger.info("No auth cache_path set, workers log in again when the current token expires")
+        context = {**context, "token": None, "token_seed": (token.get_token(), token.expires_on)}
+
+    queue = WorkQueue(queue_path)
+    try:
+        queue.enqueue(read_requests(input_path))
+        requeued = queue.requeue(max_attempts)
+        if requeued:
+            logger.info("Requeued %d unfinished items from %s", requeued, queue_path)
+
+        mp_context = multiprocessing.get_context("spawn")
+        processes = [
+            mp_context.Process(
+                target=_worker_main,
+                args=(queue_path, worker_id, context, concurrency),
+                name=f"kusto-worker-{worker_id}",
+            )
+            for worker_id in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            if process.exitcode:
+                logger.warning("%s exited with code %s", process.name, process.exitcode)
+
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for result in queue.results():
+                f.write(result + "\n")
+        os.replace(tmp_path, output_path)
+        counts = queue.counts()
+    finally:
+        queue.close()
+
+    return {
+        "succeeded": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "unfinished": counts.get("pending", 0) + counts.get("running", 0),
+        "elapsed": round(time.perf_counter() - started, 4),
+    }